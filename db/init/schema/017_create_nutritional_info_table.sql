@@ -73,6 +73,12 @@ CREATE TABLE IF NOT EXISTS nutritional_info (
   updated_at TIMESTAMPTZ DEFAULT now()
 );
 
+-- Index duplicate product names are matched on during import
+CREATE INDEX IF NOT EXISTS idx_nutritional_info_product_name_clean
+ON nutritional_info (
+  lower(trim(product_name))
+);
+
 -- Add trigger for updated_at timestamp
 CREATE TRIGGER nutritional_info_updated_at
 BEFORE UPDATE ON nutritional_info
@@ -5,319 +5,392 @@
 
 """Allergen mapping for OpenFoodFacts data import."""
 
-import pandas as pd
+import re
+import unicodedata
+from functools import lru_cache
+
+from data_cleaning import is_missing
+from pattern_matching import build_automaton, find_matches
+
+# Define comprehensive mapping from CSV values to enum values
+_ALLERGEN_MAPPING = {
+    # Milk and dairy (various languages and formats)
+    "MILK": [
+        "milk",
+        "milch",
+        "lait",
+        "leite",
+        "mleko",
+        "latte",
+        "mléko",
+        "mjölk",
+        "kuhmilch",
+        "cow milk",
+        "cow's milk",
+        "dairy",
+        "dairy products",
+        "milk products",
+        "milk derivatives",
+        "milkfat",
+        "butter",
+        "butterfat",
+        "cream",
+        "cheese",
+        "whey",
+        "casein",
+        "lactose",
+        "yogurt",
+        "yoghurt",
+        "cheddar",
+        "mozzarella",
+        "emmental",
+        "milk protein",
+        "milk solids",
+        "cultured milk",
+        "pasteurized milk",
+        "nonfat milk",
+        "whole milk",
+        "milchprodukte",
+        "milchbestandteile",
+        "milcheiweiß",
+        "milcheiweiss",
+    ],
+    # Eggs (various languages)
+    "EGGS": [
+        "eggs",
+        "egg",
+        "eier",
+        "ovo",
+        "uova",
+        "jajka",
+        "eieren",
+        "œuf",
+        "hühnerei",
+        "egg white",
+        "egg powder",
+        "eigelb",
+        "albumin",
+    ],
+    # Wheat and gluten
+    "WHEAT": [
+        "wheat",
+        "weizen",
+        "blé",
+        "trigo",
+        "wheat flour",
+        "wheat gluten",
+        "weizenmehl",
+        "wheat starch",
+        "wheat derivatives",
+        "durum wheat",
+        "wheat protein",
+        "weizenprotein",
+        "hartweizengrieß",
+    ],
+    "GLUTEN": [
+        "gluten",
+        "glutenhaltiges getreide",
+        "cereals containing gluten",
+        "céréales contenant du gluten",
+        "gluten-containing cereals",
+    ],
+    # Soybeans
+    "SOYBEANS": [
+        "soy",
+        "soja",
+        "soya",
+        "soybeans",
+        "sojabohnen",
+        "soybean",
+        "soy protein",
+        "soy lecithin",
+        "sojaprotein",
+        "sojaöl",
+    ],
+    # Tree nuts (general and specific)
+    "TREE_NUTS": [
+        "tree nuts",
+        "nuts",
+        "nüsse",
+        "noix",
+        "fruits à coque",
+        "frutta a guscio",
+        "tree nut",
+        "nut allergy",
+    ],
+    "ALMONDS": [
+        "almonds",
+        "almond",
+        "mandeln",
+        "amandes",
+        "mandorle",
+        "almendras",
+        "almond butter",
+        "almond flour",
+        "almond milk",
+    ],
+    "CASHEWS": ["cashews", "cashew", "cashew nuts", "cashew-nüsse", "cashewkeme"],
+    "HAZELNUTS": ["hazelnuts", "hazelnut", "haselnüsse", "haselnuss", "hazlenut"],
+    "WALNUTS": ["walnuts", "walnut", "walnüsse", "wallnuts", "black walnuts"],
+    # Peanuts
+    "PEANUTS": [
+        "peanuts",
+        "peanut",
+        "erdnüsse",
+        "arachides",
+        "pinda",
+        "peanut butter",
+        "peanut oil",
+        "groundnuts",
+    ],
+    # Fish and seafood
+    "FISH": [
+        "fish",
+        "fisch",
+        "poisson",
+        "pescado",
+        "pesce",
+        "vis",
+        "anchovy",
+        "anchovies",
+        "sardines",
+        "tuna",
+        "salmon",
+        "hoki",
+        "pollock",
+        "bonito",
+        "herring",
+        "flying fish",
+    ],
+    "SHELLFISH": [
+        "shellfish",
+        "crustacean",
+        "shrimp",
+        "prawns",
+        "crab",
+        "lobster",
+        "crayfish",
+        "garnelen",
+        "molluscs",
+        "mollusks",
+        "oyster",
+        "mussel",
+        "clam",
+        "scallop",
+    ],
+    # Sesame
+    "SESAME": [
+        "sesame",
+        "sesame seeds",
+        "sésame",
+        "sesamsaat",
+        "graines de sésame",
+        "white sesame seeds",
+    ],
+    # Mustard
+    "MUSTARD": [
+        "mustard",
+        "senf",
+        "moutarde",
+        "mustard seed",
+        "mustard seeds",
+        "gelbsenfsaat",
+        "braunsenfsaat",
+    ],
+    # Celery
+    "CELERY": [
+        "celery",
+        "sellerie",
+        "céleri",
+        "celery powder",
+        "schnittselerie",
+        "schnittsellerie",
+    ],
+    # Sulphites
+    "SULPHITES": [
+        "sulphites",
+        "sulfites",
+        "sulfit",
+        "sulfur dioxide",
+        "metabisulphite",
+        "sodium metabisulphite",
+        "kaliummetabisulfit",
+        "ammoniumsulfit",
+        "natriummetabisulfit",
+    ],
+    # Coconut
+    "COCONUT": ["coconut", "coconuts", "noix de coco", "coconut oil"],
+    # Alcohol
+    "ALCOHOL": ["alcohol", "alkohol", "ethanol"],
+    # Phenylalanine
+    "PHENYLALANINE": [
+        "phenylalanine",
+        "phenylalalnine",
+        "phenilananin",
+        "phenylalaninquelle",
+    ],
+    "LUPIN": ["lupin", "lupine", "lupins"],
+    "CORN": [
+        "corn",
+        "maize",
+        "mais",
+        "corn starch",
+        "corn flour",
+        "yellow corn",
+        "sweet corn",
+    ],
+    "YEAST": ["yeast", "hefe", "levure", "baker yeast", "nutritional yeast"],
+    "GELATIN": ["gelatin", "gelatine", "beef gelatin", "pork gelatin"],
+    "KIWI": ["kiwi", "kiwi fruit"],
+    # Religious/Dietary
+    "PORK": [
+        "pork",
+        "schwein",
+        "porc",
+        "pig",
+        "ham",
+        "bacon",
+        "pork gelatin",
+        "lard",
+    ],
+    "BEEF": ["beef", "rind", "bœuf", "cow", "cattle", "beef gelatin"],
+    # Additives/Chemicals
+    "SULFUR_DIOXIDE": ["sulfur dioxide", "sulphur dioxide", "so2", "e220"],
+}
+
+
+# Combining marks left over after NFKD decomposition, e.g. the accent in "é"
+_COMBINING_MARKS_RE = re.compile(r"[\u0300-\u036f]")
+
+
+def _fold_accents(text):
+    """Strip accents from text, "sésame" becomes "sesame"; ASCII is returned as is."""
+    if text.isascii():
+        return text
+    return _COMBINING_MARKS_RE.sub("", unicodedata.normalize("NFKD", text))
+
+
+def _expand_patterns(mapping, min_length=4):
+    """List (pattern, enum) pairs plus an unaccented variant of accented patterns.
+
+    Short variants are left out since they collide with ordinary words, "blé"
+    would become "ble" as in "vegetable".
+    """
+    pairs = []
+    for enum_value, patterns in mapping.items():
+        for pattern in patterns:
+            # Input is lowercased before matching
+            pattern = pattern.lower()
+            pairs.append((pattern, enum_value))
+            folded = _fold_accents(pattern)
+            if folded != pattern and len(folded) >= min_length:
+                pairs.append((folded, enum_value))
+    return pairs
+
+
+_ALLERGEN_PATTERNS = _expand_patterns(_ALLERGEN_MAPPING)
+
+# One bit per enum value, so sets of allergens are plain ints and union is "|"
+_ALLERGEN_BITS = {enum_value: 1 << i for i, enum_value in enumerate(_ALLERGEN_MAPPING)}
+
+# Compiled once at import: finds every pattern contained in a part
+_ALLERGEN_AUTOMATON = build_automaton(_ALLERGEN_PATTERNS)
+
+
+def _to_mask(enum_values):
+    """Combine enum values into their bitmask."""
+    mask = 0
+    for enum_value in enum_values:
+        mask |= _ALLERGEN_BITS[enum_value]
+    return mask
+
+
+# Flat pattern -> enum bitmask table for O(1) exact matches
+_PATTERN_TO_MASK = {
+    pattern: _to_mask(find_matches(_ALLERGEN_AUTOMATON, pattern))
+    for pattern, _ in _ALLERGEN_PATTERNS
+}
+
+# Obvious non-allergens
+_SKIP_TERMS = [
+    "none",
+    "nil",
+    "n/a",
+    "no known allergens",
+    "keine",
+    "warning",
+    "may contain",
+    "traces",
+    "produced in",
+    "manufactured on",
+    "water",
+    "salt",
+    "sugar",
+]
+_SKIP_RE = re.compile("|".join(re.escape(term) for term in _SKIP_TERMS))
+
+# Language tags and "contains"-style lead-ins, possibly stacked ("en:contains ")
+_PREFIX_RE = re.compile(r"^(?:(?:(?:en|de|fr|es|it):|contains[: ]|enth[äa]lt)\s*)+")
+
+# Delimiters between allergens: punctuation or a spelled-out "and"
+_SPLIT_RE = re.compile(r"[,;|/+&]|\s+and\s+|\s+et\s+|\s+und\s+")
+
+
+@lru_cache(maxsize=100_000)
+def _part_mask(part):
+    """Bitmask of the allergens in one delimited part; parts repeat heavily."""
+    # Clean the part
+    clean_part = part.strip()
+
+    # Remove common prefixes
+    clean_part = _PREFIX_RE.sub("", clean_part, count=1)
+
+    # Skip empty or very short parts
+    if len(clean_part) < 3:
+        return 0
+
+    # Skip obvious non-allergens
+    if _SKIP_RE.search(clean_part):
+        return 0
+
+    # Find matching allergens, exact pattern hits are precomputed
+    exact_match = _PATTERN_TO_MASK.get(clean_part)
+    if exact_match is not None:
+        return exact_match
+
+    mask = _to_mask(find_matches(_ALLERGEN_AUTOMATON, clean_part))
+
+    # Accented input may spell a pattern known without accents
+    if not clean_part.isascii():
+        folded_part = _fold_accents(clean_part)
+        mask |= _to_mask(find_matches(_ALLERGEN_AUTOMATON, folded_part))
+
+    return mask
+
+
+@lru_cache(maxsize=4096)
+def _mask_to_enums(mask):
+    """Decode a bitmask back into its enum values, in mapping order."""
+    return tuple(enum_value for enum_value, bit in _ALLERGEN_BITS.items() if mask & bit)
+
+
+@lru_cache(maxsize=65_536)
+def _string_mask(allergen_string):
+    """Bitmask of the allergens in a whole CSV value; values repeat across chunks."""
+    # Lowercase once up front rather than once per part
+    allergen_string = allergen_string.lower()
+
+    # Split allergen string on every common delimiter in one pass, the union of
+    # the parts is a bitwise or
+    mask = 0
+    for part in _SPLIT_RE.split(allergen_string):
+        mask |= _part_mask(part)
+    return mask
 
 
 def map_allergens_to_enum(allergen_string):
     """Map raw allergen string from CSV to standardized enum values."""
-    if pd.isna(allergen_string) or not allergen_string or allergen_string.strip() == "":
+    if is_missing(allergen_string) or not allergen_string.strip():
         return []
 
-    # Define comprehensive mapping from CSV values to enum values
-    allergen_mapping = {
-        # Milk and dairy (various languages and formats)
-        "MILK": [
-            "milk",
-            "milch",
-            "lait",
-            "leite",
-            "mleko",
-            "latte",
-            "mléko",
-            "mjölk",
-            "kuhmilch",
-            "cow milk",
-            "cow's milk",
-            "dairy",
-            "dairy products",
-            "milk products",
-            "milk derivatives",
-            "milkfat",
-            "butter",
-            "butterfat",
-            "cream",
-            "cheese",
-            "whey",
-            "casein",
-            "lactose",
-            "yogurt",
-            "yoghurt",
-            "cheddar",
-            "mozzarella",
-            "emmental",
-            "milk protein",
-            "milk solids",
-            "cultured milk",
-            "pasteurized milk",
-            "nonfat milk",
-            "whole milk",
-            "milchprodukte",
-            "milchbestandteile",
-            "milcheiweiß",
-            "milcheiweiss",
-        ],
-        # Eggs (various languages)
-        "EGGS": [
-            "eggs",
-            "egg",
-            "eier",
-            "ovo",
-            "uova",
-            "jajka",
-            "eieren",
-            "œuf",
-            "hühnerei",
-            "egg white",
-            "egg powder",
-            "eigelb",
-            "albumin",
-        ],
-        # Wheat and gluten
-        "WHEAT": [
-            "wheat",
-            "weizen",
-            "blé",
-            "trigo",
-            "wheat flour",
-            "wheat gluten",
-            "weizenmehl",
-            "wheat starch",
-            "wheat derivatives",
-            "durum wheat",
-            "wheat protein",
-            "weizenprotein",
-            "hartweizengrieß",
-        ],
-        "GLUTEN": [
-            "gluten",
-            "glutenhaltiges getreide",
-            "cereals containing gluten",
-            "céréales contenant du gluten",
-            "gluten-containing cereals",
-        ],
-        # Soybeans
-        "SOYBEANS": [
-            "soy",
-            "soja",
-            "soya",
-            "soybeans",
-            "sojabohnen",
-            "soybean",
-            "soy protein",
-            "soy lecithin",
-            "sojaprotein",
-            "sojaöl",
-        ],
-        # Tree nuts (general and specific)
-        "TREE_NUTS": [
-            "tree nuts",
-            "nuts",
-            "nüsse",
-            "noix",
-            "fruits à coque",
-            "frutta a guscio",
-            "tree nut",
-            "nut allergy",
-        ],
-        "ALMONDS": [
-            "almonds",
-            "almond",
-            "mandeln",
-            "amandes",
-            "mandorle",
-            "almendras",
-            "almond butter",
-            "almond flour",
-            "almond milk",
-        ],
-        "CASHEWS": ["cashews", "cashew", "cashew nuts", "cashew-nüsse", "cashewkeme"],
-        "HAZELNUTS": ["hazelnuts", "hazelnut", "haselnüsse", "haselnuss", "hazlenut"],
-        "WALNUTS": ["walnuts", "walnut", "walnüsse", "wallnuts", "black walnuts"],
-        # Peanuts
-        "PEANUTS": [
-            "peanuts",
-            "peanut",
-            "erdnüsse",
-            "arachides",
-            "pinda",
-            "peanut butter",
-            "peanut oil",
-            "groundnuts",
-        ],
-        # Fish and seafood
-        "FISH": [
-            "fish",
-            "fisch",
-            "poisson",
-            "pescado",
-            "pesce",
-            "vis",
-            "anchovy",
-            "anchovies",
-            "sardines",
-            "tuna",
-            "salmon",
-            "hoki",
-            "pollock",
-            "bonito",
-            "herring",
-            "flying fish",
-        ],
-        "SHELLFISH": [
-            "shellfish",
-            "crustacean",
-            "shrimp",
-            "prawns",
-            "crab",
-            "lobster",
-            "crayfish",
-            "garnelen",
-            "molluscs",
-            "mollusks",
-            "oyster",
-            "mussel",
-            "clam",
-            "scallop",
-        ],
-        # Sesame
-        "SESAME": [
-            "sesame",
-            "sesame seeds",
-            "sésame",
-            "sesamsaat",
-            "graines de sésame",
-            "white sesame seeds",
-        ],
-        # Mustard
-        "MUSTARD": [
-            "mustard",
-            "senf",
-            "moutarde",
-            "mustard seed",
-            "mustard seeds",
-            "gelbsenfsaat",
-            "braunsenfsaat",
-        ],
-        # Celery
-        "CELERY": [
-            "celery",
-            "sellerie",
-            "céleri",
-            "celery powder",
-            "schnittselerie",
-            "schnittsellerie",
-        ],
-        # Sulphites
-        "SULPHITES": [
-            "sulphites",
-            "sulfites",
-            "sulfit",
-            "sulfur dioxide",
-            "metabisulphite",
-            "sodium metabisulphite",
-            "kaliummetabisulfit",
-            "ammoniumsulfit",
-            "natriummetabisulfit",
-        ],
-        # Coconut
-        "COCONUT": ["coconut", "coconuts", "noix de coco", "coconut oil"],
-        # Alcohol
-        "ALCOHOL": ["alcohol", "alkohol", "ethanol"],
-        # Phenylalanine
-        "PHENYLALANINE": [
-            "phenylalanine",
-            "phenylalalnine",
-            "phenilananin",
-            "phenylalaninquelle",
-        ],
-        "LUPIN": ["lupin", "lupine", "lupins"],
-        "CORN": [
-            "corn",
-            "maize",
-            "mais",
-            "corn starch",
-            "corn flour",
-            "yellow corn",
-            "sweet corn",
-        ],
-        "YEAST": ["yeast", "hefe", "levure", "baker yeast", "nutritional yeast"],
-        "GELATIN": ["gelatin", "gelatine", "beef gelatin", "pork gelatin"],
-        "KIWI": ["kiwi", "kiwi fruit"],
-        # Religious/Dietary
-        "PORK": [
-            "pork",
-            "schwein",
-            "porc",
-            "pig",
-            "ham",
-            "bacon",
-            "pork gelatin",
-            "lard",
-        ],
-        "BEEF": ["beef", "rind", "bœuf", "cow", "cattle", "beef gelatin"],
-        # Additives/Chemicals
-        "SULFUR_DIOXIDE": ["sulfur dioxide", "sulphur dioxide", "so2", "e220"],
-    }
-
-    # Split allergen string by common delimiters
-    allergen_parts = []
-    for delimiter in [",", ";", "|", "/", "+", "&", " and ", " et ", " und "]:
-        if delimiter in allergen_string:
-            allergen_parts = allergen_string.split(delimiter)
-            break
-
-    if not allergen_parts:
-        allergen_parts = [allergen_string]
-
-    # Clean and normalize each part
-    found_allergens = set()
-
-    for part in allergen_parts:
-        # Clean the part
-        clean_part = part.strip().lower()
-
-        # Remove common prefixes
-        for prefix in [
-            "en:",
-            "de:",
-            "fr:",
-            "es:",
-            "it:",
-            "contains:",
-            "contains ",
-            "enthält",
-        ]:
-            if clean_part.startswith(prefix):
-                clean_part = clean_part[len(prefix) :].strip()
-
-        # Skip empty or very short parts
-        if len(clean_part) < 3:
-            continue
-
-        # Skip obvious non-allergens
-        skip_terms = [
-            "none",
-            "nil",
-            "n/a",
-            "no known allergens",
-            "keine",
-            "warning",
-            "may contain",
-            "traces",
-            "produced in",
-            "manufactured on",
-            "water",
-            "salt",
-            "sugar",
-        ]
-        if any(skip in clean_part for skip in skip_terms):
-            continue
-
-        # Find matching allergens
-        for enum_value, patterns in allergen_mapping.items():
-            for pattern in patterns:
-                if pattern.lower() in clean_part or clean_part in pattern.lower():
-                    found_allergens.add(enum_value)
-                    break
-
-    return list(found_allergens)
+    return list(_mask_to_enums(_string_mask(allergen_string)))
@@ -7,11 +7,90 @@
 
 import logging
 import re
+from functools import lru_cache
 
+import numpy as np
 import pandas as pd
 
 logger = logging.getLogger(__name__)
 
+# Vitamin and mineral columns stored as DECIMAL(10,6)
+VITAMIN_MINERAL_COLUMNS = frozenset(
+    [
+        "vitamin-a_100g",
+        "vitamin-b6_100g",
+        "vitamin-b12_100g",
+        "vitamin-c_100g",
+        "vitamin-d_100g",
+        "vitamin-e_100g",
+        "vitamin-k_100g",
+        "calcium_100g",
+        "iron_100g",
+        "magnesium_100g",
+        "potassium_100g",
+        "sodium_100g",
+        "zinc_100g",
+    ]
+)
+
+# Serving size units - order matters (more specific first)
+_UNIT_PATTERNS = [
+    ("TBSP", [r"\btbsp\b", r"\btablespoon\b"]),
+    ("TSP", [r"\btsp\b", r"\bteaspoon\b"]),
+    ("CUP", [r"\bcup\b", r"\bcups\b"]),
+    ("ML", [r"\bml\b", r"\bmilliliter\b"]),
+    ("L", [r"\bl\b(?!\w)", r"\bliter\b"]),
+    ("KG", [r"\bkg\b", r"\bkilogram\b"]),
+    ("G", [r"\bg\b(?!\w)", r"\bgram\b", r"\bgr\b"]),
+    ("OZ", [r"\boz\b", r"\bonce\b", r"\bounce\b"]),
+    ("LB", [r"\blb\b", r"\bpound\b"]),
+    ("SLICE", [r"\bslice\b", r"\bslices\b"]),
+    ("PIECE", [r"\bpiece\b", r"\bpieces\b"]),
+    ("CAN", [r"\bcan\b"]),
+    ("BOTTLE", [r"\bbottle\b"]),
+    ("PACKET", [r"\bpacket\b", r"\bpkg\b", r"\bpackage\b"]),
+    ("UNIT", [r"\bunit\b", r"\bunits\b"]),
+]
+_UNIT_PRIORITY = [enum_val for enum_val, _ in _UNIT_PATTERNS]
+
+# Only weight/volume units count when found in parentheses
+_PAREN_UNIT_PRIORITY = ["ML", "L", "KG", "G", "OZ", "LB"]
+
+# One alternation with a named group per unit; every pattern is a whole word,
+# so a single finditer sweep sees each unit mentioned in the string
+_UNIT_RE = re.compile(
+    "|".join(
+        f"(?P<{enum_val}>{'|'.join(patterns)})" for enum_val, patterns in _UNIT_PATTERNS
+    )
+)
+_PAREN_RE = re.compile(r"\(([^)]*)\)")
+_NUMBER_RE = re.compile(r"(\d+(?:\.\d+)?)")
+_FRACTION_RE = re.compile(r"(\d+(?:\.\d+)?)\s*/\s*(\d+(?:\.\d+)?)")
+_PIECE_WORDS_RE = re.compile(r"cookie|cracker|whole|stick|bar")
+_UNIT_WORDS_RE = re.compile(r"serving|portion")
+
+# Valid nutriscore grades, keyed by the first letter of the cleaned value
+_GRADE_MAP = {grade: grade for grade in "abcde"}
+
+
+def is_missing(value):
+    """Cheap scalar stand-in for pd.isna(value) or value == "" on CSV values.
+
+    CSV cells are strings, float NaN or None, so identity and type checks
+    cover them without pd.isna's generic dispatch.
+    """
+    return (
+        value is None
+        or value is pd.NA
+        or (isinstance(value, float) and value != value)
+        or value == ""
+    )
+
+
+def _find_units(text):
+    """Return the set of unit enums mentioned in text."""
+    return {match.lastgroup for match in _UNIT_RE.finditer(text)}
+
 
 def parse_serving_size(serving_size_str):
     """Parse a free-text serving size string to extract quantity and standardized unit.
@@ -24,89 +103,51 @@ def parse_serving_size(serving_size_str):
     Returns:
         tuple: (quantity, unit_enum) or (None, None) if parsing fails
     """
-    if (
-        pd.isna(serving_size_str)
-        or not serving_size_str
-        or serving_size_str.strip() == ""
-    ):
+    if is_missing(serving_size_str) or not serving_size_str.strip():
         return None, None
 
-    s = serving_size_str.lower().strip()
+    return _parse_normalized_serving_size(serving_size_str.lower().strip())
 
+
+@lru_cache(maxsize=100_000)
+def _parse_normalized_serving_size(s):
+    """Parse a lowercased, stripped serving size; serving strings repeat heavily."""
     # First priority: Look for weight/volume in parentheses like "(29 g)" or "(28 ml)"
-    paren_match = re.search(r"\(([^)]*)\)", s)
+    paren_match = _PAREN_RE.search(s)
     if paren_match:
         paren_content = paren_match.group(1).strip()
         # Try to extract number and unit from parentheses
-        paren_number = re.search(r"(\d+(?:\.\d+)?)", paren_content)
+        paren_number = _NUMBER_RE.search(paren_content)
         if paren_number:
-            paren_quantity = float(paren_number.group(1))
-
-            # Check for weight/volume units in parentheses
-            paren_unit_patterns = [
-                ("ML", [r"\bml\b", r"\bmilliliter\b"]),
-                ("L", [r"\bl\b(?!\w)", r"\bliter\b"]),
-                ("KG", [r"\bkg\b", r"\bkilogram\b"]),
-                ("G", [r"\bg\b(?!\w)", r"\bgram\b", r"\bgr\b"]),
-                ("OZ", [r"\boz\b", r"\bonce\b", r"\bounce\b"]),
-                ("LB", [r"\blb\b", r"\bpound\b"]),
-            ]
-
-            for enum_val, patterns in paren_unit_patterns:
-                for pattern in patterns:
-                    if re.search(pattern, paren_content):
-                        return paren_quantity, enum_val
+            paren_units = _find_units(paren_content)
+            for enum_val in _PAREN_UNIT_PRIORITY:
+                if enum_val in paren_units:
+                    return float(paren_number.group(1)), enum_val
 
     # Second priority: Parse the main serving description
     quantity = None
 
     # Handle fractions like "1/3", "0.25", etc.
-    fraction_match = re.search(r"(\d+(?:\.\d+)?)\s*/\s*(\d+(?:\.\d+)?)", s)
+    fraction_match = _FRACTION_RE.search(s)
     if fraction_match:
         numerator = float(fraction_match.group(1))
         denominator = float(fraction_match.group(2))
         quantity = numerator / denominator
     else:
         # Look for decimal numbers
-        number_match = re.search(r"(\d+(?:\.\d+)?)", s)
+        number_match = _NUMBER_RE.search(s)
         if number_match:
             quantity = float(number_match.group(1))
 
-    # Unit mapping - order matters (more specific first)
-    unit_patterns = [
-        ("TBSP", [r"\btbsp\b", r"\btablespoon\b"]),
-        ("TSP", [r"\btsp\b", r"\bteaspoon\b"]),
-        ("CUP", [r"\bcup\b", r"\bcups\b"]),
-        ("ML", [r"\bml\b", r"\bmilliliter\b"]),
-        ("L", [r"\bl\b(?!\w)", r"\bliter\b"]),
-        ("KG", [r"\bkg\b", r"\bkilogram\b"]),
-        ("G", [r"\bg\b(?!\w)", r"\bgram\b", r"\bgr\b"]),
-        ("OZ", [r"\boz\b", r"\bonce\b", r"\bounce\b"]),
-        ("LB", [r"\blb\b", r"\bpound\b"]),
-        ("SLICE", [r"\bslice\b", r"\bslices\b"]),
-        ("PIECE", [r"\bpiece\b", r"\bpieces\b"]),
-        ("CAN", [r"\bcan\b"]),
-        ("BOTTLE", [r"\bbottle\b"]),
-        ("PACKET", [r"\bpacket\b", r"\bpkg\b", r"\bpackage\b"]),
-        ("UNIT", [r"\bunit\b", r"\bunits\b"]),
-    ]
-
-    unit = None
-    for enum_val, patterns in unit_patterns:
-        for pattern in patterns:
-            if re.search(pattern, s):
-                unit = enum_val
-                break
-        if unit:
-            break
+    # Pick the most specific unit mentioned anywhere in the description
+    units = _find_units(s)
+    unit = next((enum_val for enum_val in _UNIT_PRIORITY if enum_val in units), None)
 
     # Special cases for common serving descriptions
     if not unit:
-        if any(word in s for word in ["cookie", "cracker", "whole"]) or any(
-            word in s for word in ["stick", "bar"]
-        ):
+        if _PIECE_WORDS_RE.search(s):
             unit = "PIECE"
-        elif any(word in s for word in ["serving", "portion"]) or (s and quantity):
+        elif _UNIT_WORDS_RE.search(s) or (s and quantity):
             unit = "UNIT"
 
     # If we found a unit but no quantity, default to 1.0
@@ -116,116 +157,64 @@ def parse_serving_size(serving_size_str):
     return quantity, unit
 
 
-def clean_numeric_value(value, column_name=None):
-    """Clean and convert a value to a numeric type.
+def parse_serving_size_column(values):
+    """Parse a whole column of serving size strings.
+
+    Each distinct string is parsed once and the results are mapped back onto
+    the column.
+
+    Returns:
+        tuple: (quantity Series, unit Series) aligned with values
+    """
+    parsed = {value: parse_serving_size(value) for value in values.dropna().unique()}
+    quantities = values.map(lambda value: parsed.get(value, (None, None))[0])
+    units = values.map(lambda value: parsed.get(value, (None, None))[1])
+    return quantities, units
+
+
+def _clamp_round(array, limit, ndigits=None):
+    """Round a float array in place, setting NaN, infinite and |x| >= limit to NaN."""
+    in_range = np.abs(array) < limit
+    if ndigits is not None:
+        np.round(array, ndigits, out=array)
+    array[~in_range] = np.nan
+    return array
 
-    Handles various formats and database precision limits.
+
+def clean_numeric_column(values, column_name=None):
+    """Clean and convert a whole column to numeric values.
+
+    Unparseable, infinite and out-of-range values become NaN.
     """
-    if pd.isna(value) or value == "" or value is None:
-        return None
-
-    try:
-        # Convert to string and strip whitespace
-        str_val = str(value).strip()
-
-        # Handle empty strings
-        if not str_val or str_val.lower() == "nan":
-            return None
-
-        # Try to convert to float
-        numeric_val = float(str_val)
-
-        # Handle infinite or NaN values
-        if not (numeric_val == numeric_val and abs(numeric_val) != float("inf")):
-            return None
-
-        # Apply database precision limits based on column type
-        if column_name:
-            # Vitamins and minerals: DECIMAL(10,6) - max value 9999.999999
-            vitamin_mineral_columns = [
-                "vitamin-a_100g",
-                "vitamin-b6_100g",
-                "vitamin-b12_100g",
-                "vitamin-c_100g",
-                "vitamin-d_100g",
-                "vitamin-e_100g",
-                "vitamin-k_100g",
-                "calcium_100g",
-                "iron_100g",
-                "magnesium_100g",
-                "potassium_100g",
-                "sodium_100g",
-                "zinc_100g",
-            ]
-
-            if column_name in vitamin_mineral_columns:
-                if abs(numeric_val) >= 10000:  # Precision limit for DECIMAL(10,6)
-                    logger.debug(
-                        (
-                            f"Value {numeric_val} for {column_name} exceeds "
-                            "DECIMAL(10,6) limit, setting to NULL"
-                        )
-                    )
-                    return None
-                # Round to 6 decimal places
-                numeric_val = round(numeric_val, 6)
-            # Macro-nutrients and serving quantity: DECIMAL(8,3) - max value 99999.999
-            elif (
-                column_name.endswith("_100g")
-                or column_name == "nutriscore_score"
-                or column_name == "serving_quantity"
-            ):
-                if abs(numeric_val) >= 100000:  # Precision limit for DECIMAL(8,3)
-                    logger.debug(
-                        f"Value {numeric_val} for {column_name} exceeds "
-                        "DECIMAL(8,3) limit, setting to NULL"
-                    )
-                    return None
-                # Round to 3 decimal places
-                numeric_val = round(numeric_val, 3)
-
-        # General sanity check for extremely large values
-        if abs(numeric_val) >= 1e6:  # 1 million - likely data error
-            return None
-
-        return numeric_val
-
-    except (ValueError, TypeError):
-        return None
-
-
-def clean_nutriscore_grade(value):
-    """Clean and validate nutriscore_grade values."""
-    if pd.isna(value) or value == "" or value is None:
-        return None
-
-    try:
-        # Convert to string and clean
-        str_val = str(value).strip().lower()
-
-        # Handle empty strings
-        if not str_val or str_val.lower() == "nan":
-            return None
-
-        # Valid nutriscore grades are a, b, c, d, e
-        if str_val in ["a", "b", "c", "d", "e"]:
-            return str_val
-
-        # Handle some common variations/errors
-        if str_val.startswith("a"):
-            return "a"
-        elif str_val.startswith("b"):
-            return "b"
-        elif str_val.startswith("c"):
-            return "c"
-        elif str_val.startswith("d"):
-            return "d"
-        elif str_val.startswith("e"):
-            return "e"
-
-        # If we can't parse it, log and return None
-        logger.debug(f"Invalid nutriscore_grade value: '{value}', setting to NULL")
-        return None
-
-    except (ValueError, TypeError):
-        return None
+    array = pd.to_numeric(values, errors="coerce").to_numpy(
+        dtype="float64", na_value=np.nan, copy=True
+    )
+
+    # Sanity limit of 1e6 for extremely large values, tightened to the column's
+    # DECIMAL precision where one applies. NaN and inf fail the comparison too.
+    if column_name in VITAMIN_MINERAL_COLUMNS:
+        # DECIMAL(10,6) - max value 9999.999999
+        _clamp_round(array, 10000, 6)
+    elif column_name and (
+        column_name.endswith("_100g")
+        or column_name == "nutriscore_score"
+        or column_name == "serving_quantity"
+    ):
+        # DECIMAL(8,3) - max value 99999.999
+        _clamp_round(array, 100000, 3)
+    else:
+        _clamp_round(array, 1e6)
+
+    return pd.Series(array, index=values.index, name=values.name)
+
+
+def clean_nutriscore_grade_column(values):
+    """Clean and validate a whole column of nutriscore_grade values."""
+    first_letter = values.astype("string").str.strip().str.lower().str[:1]
+    return first_letter.map(_GRADE_MAP)
+
+
+def clean_text_column(values):
+    """Strip a whole column of text values, turning blanks into NaN."""
+    stripped = values.astype("string").str.strip()
+    return stripped.where(stripped != "")
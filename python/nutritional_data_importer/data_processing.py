@@ -6,28 +6,24 @@
 """Data processing utilities for OpenFoodFacts data import."""
 
 import logging
+import re
 
+import numpy as np
 import pandas as pd
 from allergen_mapping import map_allergens_to_enum
 from data_cleaning import (
-    clean_numeric_value,
-    clean_nutriscore_grade,
-    parse_serving_size,
+    clean_numeric_column,
+    clean_nutriscore_grade_column,
+    clean_text_column,
+    parse_serving_size_column,
 )
 from food_groups_mapping import map_food_groups_to_enum
 
 logger = logging.getLogger(__name__)
 
-
-def prepare_row_data(row, csv_columns, target_columns):
-    """Prepare a single row of data for database insertion."""
-    row_data = []
-
-    # Pre-parse serving info since it creates multiple target columns from one source
-    parsed_quantity, parsed_unit = parse_serving_size(row.get("serving_size"))
-
-    # Define which columns are numeric and need cleaning
-    numeric_columns = [
+# Columns that are numeric and need cleaning
+NUMERIC_COLUMNS = frozenset(
+    [
         "nutriscore_score",
         "energy-kcal_100g",
         "carbohydrates_100g",
@@ -61,118 +57,92 @@ def prepare_row_data(row, csv_columns, target_columns):
         "zinc_100g",
         "serving_quantity",
     ]
+)
+
+# Merge policy: numeric fields where a non-zero value replaces zero, and text
+# fields where longer content wins
+MERGE_NUMERIC_COLUMNS = NUMERIC_COLUMNS - {"serving_quantity"}
+PREFER_LONGER_COLUMNS = frozenset(["brands", "categories", "allergens"])
+
+# Country values that identify an American product, e.g. "United States",
+# "en:united-states" or "USA"
+_AMERICAN_RE = re.compile(
+    r"\b(?:united[ -]states|usa|us)\b|en:(?:united-states|usa|us)", re.IGNORECASE
+)
+
+# Country fields checked by is_american_mask
+COUNTRY_COLUMNS = ["countries", "countries_tags", "countries_en"]
 
+
+def _map_distinct(values, func):
+    """Apply func once per distinct value of a column, NaN included."""
+    codes, uniques = pd.factorize(values, use_na_sentinel=False)
+    mapped = np.empty(len(uniques), dtype=object)
+    for i, value in enumerate(uniques):
+        mapped[i] = func(value)
+    return pd.Series(mapped[codes], index=values.index)
+
+
+def clean_chunk(df_chunk, csv_columns, target_columns):
+    """Clean every target column of a chunk, one vectorized pass per column.
+
+    Returns:
+        dict: Target column name -> cleaned Series aligned with df_chunk
+    """
+    # Serving info creates multiple target columns from one source
+    if "serving_size" in csv_columns:
+        quantities, units = parse_serving_size_column(df_chunk["serving_size"])
+    else:
+        quantities = units = pd.Series(None, index=df_chunk.index, dtype=object)
+
+    cleaned = {}
     for col in target_columns:
-        # Handle derived columns from serving_size parsing
         if col == "serving_quantity":
-            value = clean_numeric_value(parsed_quantity, col)
+            cleaned[col] = clean_numeric_column(quantities, col)
         elif col == "serving_measurement":
-            value = parsed_unit
+            cleaned[col] = units
         elif col in csv_columns:
-            value = row[col]
+            values = df_chunk[col]
 
-            # Handle allergens column specially - convert to enum array
+            # Allergens become enum arrays, empty arrays become NULL
             if col == "allergens":
-                allergen_enums = map_allergens_to_enum(value)
-                # Convert to PostgreSQL array format
-                if allergen_enums:
-                    value = allergen_enums
-                else:
-                    value = None
-            # Handle food_groups column specially - convert to enum
+                cleaned[col] = _map_distinct(
+                    values, lambda value: map_allergens_to_enum(value) or None
+                )
             elif col == "food_groups":
-                value = map_food_groups_to_enum(value)
-            # Handle numeric columns with precision limits
-            elif col in numeric_columns:
-                value = clean_numeric_value(value, col)
-            # Handle nutriscore_grade specifically
+                cleaned[col] = _map_distinct(values, map_food_groups_to_enum)
+            elif col in NUMERIC_COLUMNS:
+                cleaned[col] = clean_numeric_column(values, col)
             elif col == "nutriscore_grade":
-                value = clean_nutriscore_grade(value)
-            # Handle text columns
-            elif value is not None and not pd.isna(value):
-                value = str(value).strip()
-                if not value:  # Empty string
-                    value = None
+                cleaned[col] = clean_nutriscore_grade_column(values)
             else:
-                value = None
+                cleaned[col] = clean_text_column(values)
         else:
             # Column not in CSV, set to None
-            value = None
-
-        row_data.append(value)
-
-    return row_data
+            cleaned[col] = pd.Series(None, index=df_chunk.index, dtype=object)
 
+    return cleaned
 
-def is_american_product(row):
-    """Check if a product is from the United States."""
-    try:
-        # Check the countries field
-        countries = row.get("countries", "")
-        countries_tags = row.get("countries_tags", "")
-        countries_en = row.get("countries_en", "")
 
-        # List of potential American identifiers
-        american_identifiers = [
-            "united states",
-            "usa",
-            "us",
-            "united-states",
-            "en:united-states",
-            "en:usa",
-            "en:us",
-        ]
+def prepare_chunk_data(df_chunk, csv_columns, target_columns):
+    """Prepare all rows of a chunk for database insertion.
 
-        # Check all country fields
-        for field in [countries, countries_tags, countries_en]:
-            if pd.isna(field):
-                continue
-
-            field_str = str(field).lower()
-
-            # Check if any American identifier is in the field
-            for identifier in american_identifiers:
-                if identifier in field_str:
-                    return True
-
-        # If no American identifiers found, not an American product
-        return False
-
-    except Exception as e:
-        # If there's an error, default to not American to be safe
-        logger.debug(f"Error checking if product is American: {e}")
-        return False
-
-
-def should_update_field(existing_value, new_value, column_name):
-    """Determine if a field should be updated based on merge logic."""
-    # Don't update if new value is null/empty
-    if new_value is None or new_value == "":
-        return False
-
-    # Always update if existing is null/empty
-    if existing_value is None or existing_value == "":
-        return True
-
-    # For numeric nutrition fields, prefer non-zero values
-    if column_name.endswith("_100g") or column_name == "nutriscore_score":
-        try:
-            existing_num = float(existing_value) if existing_value is not None else 0
-            new_num = float(new_value) if new_value is not None else 0
-
-            # Update if existing is 0 and new is non-zero
-            if existing_num == 0 and new_num > 0:
-                return True
-
-            # Don't update if we already have a good value
-            return False
-
-        except (ValueError, TypeError):
-            return False
-
-    # For text fields, prefer longer/more detailed content
-    if column_name in ["brands", "categories", "allergens"]:
-        return len(str(new_value)) > len(str(existing_value))
-
-    # Default: don't update (preserve first occurrence)
-    return False
+    Columns are converted to Python lists one at a time and only zipped into
+    row tuples at the end, so no intermediate DataFrame is built.
+    """
+    cleaned = clean_chunk(df_chunk, csv_columns, target_columns)
+    columns = []
+    for col in target_columns:
+        values = cleaned[col].astype(object)
+        columns.append(values.where(values.notna(), None).tolist())
+    return list(zip(*columns))
+
+
+def is_american_mask(df_chunk):
+    """Flag the rows of a chunk from the United States."""
+    mask = pd.Series(False, index=df_chunk.index)
+    for column in COUNTRY_COLUMNS:
+        if column in df_chunk.columns:
+            values = df_chunk[column].astype("string")
+            mask |= values.str.contains(_AMERICAN_RE, na=False)
+    return mask
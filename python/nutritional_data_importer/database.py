@@ -5,53 +5,51 @@
 
 """Database connection and operations for OpenFoodFacts data import."""
 
+import csv
+import io
 import logging
 import os
 import socket
+import threading
+from functools import lru_cache
 
+import numpy as np
+import pandas as pd
 import psycopg2
-from data_cleaning import clean_numeric_value
-from sqlalchemy import MetaData, Table, create_engine, select, text, update
-from sqlalchemy.dialects.postgresql import insert as pg_insert
+from data_cleaning import VITAMIN_MINERAL_COLUMNS
+from data_processing import (
+    MERGE_NUMERIC_COLUMNS,
+    NUMERIC_COLUMNS,
+    PREFER_LONGER_COLUMNS,
+)
+from psycopg2.extras import execute_values
 
 logger = logging.getLogger(__name__)
 
-# Global SQLAlchemy objects
-_engine = None
-_metadata = None
-_nutritional_info_table = None
-
-
-def get_sqlalchemy_engine():
-    """Get SQLAlchemy engine using environment variables."""
-    global _engine
-    if _engine is None:
-        # Use the same environment variable names as psycopg2 connection
-        host = os.getenv("POSTGRES_HOST", "localhost")
-        database = os.getenv("POSTGRES_DB", "recipe_manager")
-        user = os.getenv("DB_MAINT_USER", "db_maint_user")
-        password = os.getenv("DB_MAINT_PASSWORD", "")
-        port = os.getenv("POSTGRES_PORT", "5432")
+# Column types of nutritional_info, read once per process
+_column_types = None
 
-        database_url = f"postgresql://{user}:{password}@{host}:{port}/{database}"
+# Insert statements built per target column list, reused by every batch
+_insert_queries: dict[tuple[str, ...], tuple[str, str]] = {}
+_copy_statements: dict[tuple[str, ...], tuple[str, str, str, list[int]]] = {}
+_merge_statements: dict[tuple[str, ...], tuple[str, str, str, list[int]]] = {}
 
-        logger.info(
-            f"🔧 Creating SQLAlchemy engine for: {user}@{host}:{port}/{database}"
-        )
-        _engine = create_engine(database_url)
-    return _engine
-
-
-def get_nutritional_info_table():
-    """Get SQLAlchemy Table object for nutritional_info."""
-    global _metadata, _nutritional_info_table
-    if _nutritional_info_table is None:
-        engine = get_sqlalchemy_engine()
-        _metadata = MetaData()
-        _nutritional_info_table = Table(
-            "nutritional_info", _metadata, schema="recipe_manager", autoload_with=engine
-        )
-    return _nutritional_info_table
+# Connection of each worker thread, opened on its first use
+_thread_state = threading.local()
+
+# Temp table batches are copied into before being upserted
+STAGING_TABLE = "nutritional_info_staging"
+DUPLICATES_STAGING_TABLE = "nutritional_info_duplicates"
+
+# Session settings for the bulk import, applied on every import connection
+IMPORT_SESSION_SETTINGS = {
+    # Commits return before their WAL is flushed to disk
+    "synchronous_commit": "off",
+    # Room for the DISTINCT ON sort and hash joins of the duplicate merge
+    "work_mem": "256MB",
+    # Staging temp tables stay in session memory; must precede their first use
+    "temp_buffers": "64MB",
+}
 
 
 def get_database_connection():
@@ -139,9 +137,48 @@ def get_database_connection():
         raise
 
 
+def configure_import_session(conn):
+    """Tune the session for the bulk import with IMPORT_SESSION_SETTINGS.
+
+    With synchronous_commit off a commit returns before its WAL is flushed to
+    disk. A server crash can lose the last few commits but never corrupts
+    data, and rerunning the import restores them since rows are upserted.
+    """
+    with conn.cursor() as cursor:
+        for name, value in IMPORT_SESSION_SETTINGS.items():
+            cursor.execute(f"SET {name} TO %s", (value,))
+    conn.commit()
+    logger.info(
+        "⚡ Import session settings: "
+        + ", ".join(
+            f"{name}={value}" for name, value in IMPORT_SESSION_SETTINGS.items()
+        )
+    )
+
+
+def get_thread_connection(connections):
+    """
+    Get the connection owned by the calling thread, opening it on first use.
+
+    Args:
+        connections: Every connection opened so far, for closing at the end
+
+    Returns:
+        Database connection configured for the import session
+    """
+    conn = getattr(_thread_state, "conn", None)
+    if conn is None:
+        conn = get_database_connection()
+        configure_import_session(conn)
+        _thread_state.conn = conn
+        connections.append(conn)
+    return conn
+
+
+@lru_cache(maxsize=1)
 def get_table_columns():
     """Define the mapping between CSV columns and database columns."""
-    return [
+    return (
         # Basic identifiers and info
         "code",
         "product_name",
@@ -191,45 +228,188 @@ def get_table_columns():
         "potassium_100g",
         "sodium_100g",
         "zinc_100g",
+    )
+
+
+@lru_cache(maxsize=None)
+def get_db_columns(target_columns):
+    """Database names of a tuple of CSV columns, dashes become underscores."""
+    return tuple(col.replace("-", "_") for col in target_columns)
+
+
+def build_values_template(column_types):
+    """Build an execute_values row template casting each value to its SQL type."""
+    return "({})".format(
+        ", ".join(f"%s::{column_type}" for column_type in column_types)
+    )
+
+
+def build_insert_query(conn, target_columns):
+    """
+    Build the upsert query for rows of target_columns.
+
+    Args:
+        conn: Database connection
+        target_columns: Columns of each row, in order
+
+    Returns:
+        tuple: (query, template) for execute_values
+    """
+    key = tuple(target_columns)
+    if key in _insert_queries:
+        return _insert_queries[key]
+
+    column_types = get_column_types(conn)
+
+    # Sanitize column names and validate against table schema
+    db_columns = get_db_columns(key)
+    invalid_cols = set(db_columns) - set(column_types)
+    if invalid_cols:
+        raise ValueError(f"Invalid column names: {invalid_cols}")
+
+    # Every column but the key is overwritten on conflict
+    update_clause = ", ".join(
+        f"{col} = EXCLUDED.{col}" for col in db_columns if col != "code"
+    )
+    query = (
+        f"INSERT INTO recipe_manager.nutritional_info ({', '.join(db_columns)}) "
+        f"VALUES %s ON CONFLICT (code) DO UPDATE SET {update_clause}, "
+        "updated_at = now()"
+    )
+    template = build_values_template(column_types[col] for col in db_columns)
+    _insert_queries[key] = query, template
+    return query, template
+
+
+def build_copy_statements(conn, target_columns):
+    """
+    Build the statements that load rows of target_columns through COPY.
+
+    Rows are copied into a session-local staging table and upserted from there
+    in one INSERT ... SELECT, which skips per-value parameter handling.
+
+    Args:
+        conn: Database connection
+        target_columns: Columns of each row, in order
+
+    Returns:
+        tuple: (create_sql, copy_sql, upsert_sql, array_indexes) where
+        array_indexes are the positions of array-typed columns
+    """
+    key = tuple(target_columns)
+    if key in _copy_statements:
+        return _copy_statements[key]
+
+    column_types = get_column_types(conn)
+
+    # Sanitize column names and validate against table schema
+    db_columns = get_db_columns(key)
+    invalid_cols = set(db_columns) - set(column_types)
+    if invalid_cols:
+        raise ValueError(f"Invalid column names: {invalid_cols}")
+
+    # Integers are staged as numeric so cleaned floats like "5.0" still load,
+    # the upsert casts them back
+    staging_columns = ", ".join(
+        f"{col} {'numeric' if column_types[col] == 'integer' else column_types[col]}"
+        for col in db_columns
+    )
+    create_sql = f"CREATE TEMP TABLE IF NOT EXISTS {STAGING_TABLE} ({staging_columns})"
+    copy_sql = (
+        f"COPY {STAGING_TABLE} ({', '.join(db_columns)}) FROM STDIN WITH (FORMAT csv)"
+    )
+
+    # Every column but the key is overwritten on conflict
+    update_clause = ", ".join(
+        f"{col} = EXCLUDED.{col}" for col in db_columns if col != "code"
+    )
+    upsert_sql = (
+        f"INSERT INTO recipe_manager.nutritional_info ({', '.join(db_columns)}) "
+        f"SELECT {', '.join(db_columns)} FROM {STAGING_TABLE} "
+        f"ON CONFLICT (code) DO UPDATE SET {update_clause}, updated_at = now(); "
+        f"TRUNCATE {STAGING_TABLE}"
+    )
+
+    array_indexes = [
+        index
+        for index, col in enumerate(db_columns)
+        if column_types[col].endswith("[]")
     ]
+    _copy_statements[key] = create_sql, copy_sql, upsert_sql, array_indexes
+    return _copy_statements[key]
+
+
+def rows_to_csv(rows, array_indexes):
+    """Write rows to an in-memory CSV buffer for COPY.
+
+    None is written as an empty unquoted field, which COPY reads as NULL; the
+    cleaning already turns blank strings into None. Lists become array literals.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    for row in rows:
+        if array_indexes:
+            row = list(row)
+            for index in array_indexes:
+                if row[index] is not None:
+                    row[index] = "{" + ",".join(row[index]) + "}"
+        writer.writerow(row)
+    buffer.seek(0)
+    return buffer
+
+
+def find_out_of_range_values(batch_data, target_columns):
+    """
+    Locate numeric values too large for their column's DECIMAL precision.
+
+    Every row of the batch is checked with one comparison per column group.
+
+    Args:
+        batch_data: Rows as prepared for insertion
+        target_columns: Columns of each row, in order
+
+    Returns:
+        list: (row index, column name, value, precision) tuples, in row order
+    """
+    numeric_indexes = [
+        index for index, col in enumerate(target_columns) if col in NUMERIC_COLUMNS
+    ]
+    if not batch_data or not numeric_indexes:
+        return []
 
+    columns = [target_columns[index] for index in numeric_indexes]
+    values = (
+        pd.DataFrame([[row[index] for index in numeric_indexes] for row in batch_data])
+        .apply(pd.to_numeric, errors="coerce")
+        .to_numpy(dtype="float64")
+    )
 
-def insert_single_row(conn, target_columns, row_data, results):
-    """Insert a single row (fallback for when database lookup fails)."""
-    try:
-        # Get SQLAlchemy table object
-        table = get_nutritional_info_table()
-        engine = get_sqlalchemy_engine()
-
-        # Sanitize column names and validate against table schema
-        db_columns = [col.replace("-", "_") for col in target_columns]
-        valid_columns = [col for col in db_columns if col in table.columns]
-
-        if len(valid_columns) != len(db_columns):
-            invalid_cols = set(db_columns) - set(table.columns.keys())
-            raise ValueError(f"Invalid column names: {invalid_cols}")
+    # DECIMAL(10,6) for vitamins and minerals, DECIMAL(8,3) for the rest
+    vitamin_mask = np.array([col in VITAMIN_MINERAL_COLUMNS for col in columns])
+    limits = np.where(vitamin_mask, 10000, 100000)
+    precisions = np.where(vitamin_mask, "DECIMAL(10,6)", "DECIMAL(8,3)")
 
-        # Create data dictionary for the row
-        row_dict = dict(zip(valid_columns, row_data))
+    return [
+        (row_idx, columns[col_idx], values[row_idx, col_idx], precisions[col_idx])
+        for row_idx, col_idx in np.argwhere(np.abs(values) >= limits)
+    ]
 
-        # Create PostgreSQL INSERT with ON CONFLICT using SQLAlchemy
-        stmt = pg_insert(table).values(row_dict)
 
-        # Build update dictionary for ON CONFLICT clause (exclude primary key)
-        update_dict = {
-            col.name: stmt.excluded[col.name]
-            for col in table.columns
-            if col.name in valid_columns and col.name != "code"
-        }
-        update_dict["updated_at"] = text("now()")
-
-        stmt = stmt.on_conflict_do_update(index_elements=["code"], set_=update_dict)
+def insert_single_row(conn, target_columns, row_data, results):
+    """Insert a single row (fallback for when database lookup fails)."""
+    try:
+        query, template = build_insert_query(conn, target_columns)
 
-        with engine.connect() as sqlalchemy_conn:
-            result = sqlalchemy_conn.execute(stmt)
-            sqlalchemy_conn.commit()
-            if result.rowcount > 0:
-                results["rows_imported"] += 1
+        # A savepoint keeps a failed row from aborting the import transaction
+        with conn.cursor() as cursor:
+            cursor.execute("SAVEPOINT insert_row")
+            try:
+                execute_values(cursor, query, [row_data], template=template)
+            except Exception:
+                cursor.execute("ROLLBACK TO SAVEPOINT insert_row")
+                raise
+            cursor.execute("RELEASE SAVEPOINT insert_row")
+            results["rows_imported"] += 1
 
     except Exception as e:
         error_msg = f"Failed to insert single row: {e}"
@@ -237,57 +417,83 @@ def insert_single_row(conn, target_columns, row_data, results):
         results["errors"].append(error_msg)
 
 
+def copy_rows(conn, target_columns, rows):
+    """Upsert rows through COPY, rolling back to a savepoint if they fail."""
+    create_sql, copy_sql, upsert_sql, array_indexes = build_copy_statements(
+        conn, target_columns
+    )
+
+    # One statement cannot upsert a code twice; keep the last row per code,
+    # which is what inserting the rows one after another would leave
+    code_index = target_columns.index("code")
+    unique_rows = list({row[code_index]: row for row in rows}.values())
+
+    with conn.cursor() as cursor:
+        cursor.execute("SAVEPOINT insert_batch")
+        try:
+            # Stream the rows into the staging table, then upsert them in one go
+            cursor.execute(create_sql)
+            cursor.copy_expert(copy_sql, rows_to_csv(unique_rows, array_indexes))
+            cursor.execute(upsert_sql)
+        except Exception:
+            cursor.execute(
+                "ROLLBACK TO SAVEPOINT insert_batch; RELEASE SAVEPOINT insert_batch"
+            )
+            raise
+        cursor.execute("RELEASE SAVEPOINT insert_batch")
+
+
+def recover_rows(conn, target_columns, rows, results):
+    """
+    Salvage the good rows of a failed batch by bisection.
+
+    Each half is retried through COPY and split again only if it fails, so a
+    batch with a few bad rows takes a handful of statements rather than one
+    per row. Single rows go through insert_single_row.
+
+    Args:
+        conn: Database connection
+        target_columns: Columns of each row, in order
+        rows: Rows of the failed batch
+        results: Dict with rows_imported and errors, updated in place
+    """
+    # A one-row batch has nothing to bisect, its halves would be empty
+    if len(rows) == 1:
+        insert_single_row(conn, target_columns, rows[0], results)
+        return
+
+    middle = len(rows) // 2
+    for half in (rows[:middle], rows[middle:]):
+        if len(half) == 1:
+            insert_single_row(conn, target_columns, half[0], results)
+            continue
+        try:
+            copy_rows(conn, target_columns, half)
+        except Exception:
+            recover_rows(conn, target_columns, half, results)
+        else:
+            results["rows_imported"] += len(half)
+
+
 def insert_batch_data(conn, target_columns, batch_data):
-    """Insert a batch of data into the database."""
+    """Insert a batch of data into the database.
+
+    Rows are loaded with COPY on the import connection and committed by the
+    caller; a savepoint lets a failed batch be rolled back on its own.
+    """
     imported = 0
     duplicates = 0
     errors = []
 
-    try:
-        # Get SQLAlchemy table object
-        table = get_nutritional_info_table()
-        engine = get_sqlalchemy_engine()
-
-        # Sanitize column names and validate against table schema
-        db_columns = [col.replace("-", "_") for col in target_columns]
-        valid_columns = [col for col in db_columns if col in table.columns]
-
-        if len(valid_columns) != len(db_columns):
-            invalid_cols = set(db_columns) - set(table.columns.keys())
-            raise ValueError(f"Invalid column names: {invalid_cols}")
-
-        # Convert batch data to list of dictionaries
-        batch_dicts = []
-        for row_data in batch_data:
-            row_dict = dict(zip(valid_columns, row_data))
-
-            # Handle special case for allergens column (cast to enum array)
-            if "allergens" in row_dict and row_dict["allergens"]:
-                # SQLAlchemy will handle the type casting automatically
-                pass
-
-            batch_dicts.append(row_dict)
-
-        # Create PostgreSQL INSERT with ON CONFLICT using SQLAlchemy
-        stmt = pg_insert(table)
-
-        # Build update dictionary for ON CONFLICT clause (exclude primary key)
-        update_dict = {
-            col.name: stmt.excluded[col.name]
-            for col in table.columns
-            if col.name in valid_columns and col.name != "code"
-        }
-        update_dict["updated_at"] = text("now()")
+    if not batch_data:
+        return imported, duplicates, errors
 
-        stmt = stmt.on_conflict_do_update(index_elements=["code"], set_=update_dict)
+    try:
+        copy_rows(conn, target_columns, batch_data)
 
-        with engine.connect() as sqlalchemy_conn:
-            # Execute batch insert
-            sqlalchemy_conn.execute(stmt, batch_dicts)
-            sqlalchemy_conn.commit()
-            # For ON CONFLICT DO UPDATE, rowcount is not reliable
-            # Count the actual rows processed instead
-            imported = len(batch_data)
+        # For ON CONFLICT DO UPDATE, rowcount is not reliable
+        # Count the actual rows processed instead
+        imported = len(batch_data)
 
     except Exception as e:
         # Enhanced error reporting
@@ -301,108 +507,31 @@ def insert_batch_data(conn, target_columns, batch_data):
 
         # Check for problematic values in the batch
         logger.error("🔍 SCANNING BATCH FOR PROBLEMATIC VALUES:")
-        problematic_rows = []
-
-        for row_idx, row_data in enumerate(batch_data[:5]):  # Check first 5 rows
-            logger.error(f"   Row {row_idx + 1} data:")
-            has_issues = False
-
-            for col_idx, (col_name, value) in enumerate(zip(target_columns, row_data)):
-                db_col_name = col_name.replace("-", "_")
-
-                if value is not None and isinstance(value, (int, float)):
-                    # Check for values that might cause precision issues
-                    if col_name in [
-                        "vitamin_a_100g",
-                        "vitamin_b6_100g",
-                        "vitamin_b12_100g",
-                        "vitamin_c_100g",
-                        "vitamin_d_100g",
-                        "vitamin_e_100g",
-                        "vitamin_k_100g",
-                        "calcium_100g",
-                        "iron_100g",
-                        "magnesium_100g",
-                        "potassium_100g",
-                        "sodium_100g",
-                        "zinc_100g",
-                    ]:
-                        if abs(value) >= 10000:
-                            logger.error(
-                                (
-                                    f"     🚨 {db_col_name}: {value} "
-                                    "(EXCEEDS DECIMAL(10,6) LIMIT)"
-                                )
-                            )
-                            has_issues = True
-                        elif abs(value) >= 1000:
-                            logger.error(f"     ⚠️  {db_col_name}: {value} (HIGH)")
-                        elif value != 0:
-                            logger.error(f"     ✅ {db_col_name}: {value}")
-                    elif col_name.endswith("_100g") or col_name == "nutriscore_score":
-                        if abs(value) >= 100000:
-                            logger.error(
-                                (
-                                    f"     🚨 {db_col_name}: {value} "
-                                    "(EXCEEDS DECIMAL(8,3) LIMIT)"
-                                )
-                            )
-                            has_issues = True
-                        elif abs(value) >= 10000:
-                            logger.error(f"     ⚠️  {db_col_name}: {value} (HIGH)")
-                        elif value != 0:
-                            logger.error(f"     ✅ {db_col_name}: {value}")
-                elif (
-                    value is not None and col_idx < 10
-                ):  # Show first 10 non-numeric values
-                    logger.error(f"     📝 {db_col_name}: '{value}'")
-
-            if has_issues:
-                problematic_rows.append(row_idx)
-
-        if len(batch_data) > 5:
-            logger.error(f"   ... and {len(batch_data) - 5} more rows not shown")
-
-        # Try to recover by inserting rows individually
-        logger.error("🔄 Attempting individual row inserts to salvage good data...")
-
-        # Rollback the failed batch transaction
-        conn.rollback()
-
-        # Try inserting each row individually using insert_single_row
-        success_count = 0
-        fail_count = 0
-        individual_results = {"rows_imported": 0, "errors": []}
-
-        for row_idx, row_data in enumerate(batch_data):
-            try:
-                insert_single_row(conn, target_columns, row_data, individual_results)
-                success_count += 1
-            except Exception as row_error:
-                fail_count += 1
-                if fail_count <= 5:  # Log first 5 individual failures
-                    product_code = row_data[0] if row_data else "unknown"
-                    logger.error(
-                        (
-                            f"     Row {row_idx + 1} (code: {product_code}) "
-                            f"failed: {row_error}"
-                        )
-                    )
-
-        imported = success_count
-        logger.error(
-            (
-                f"🔄 Individual insert results: {success_count} succeeded, "
-                f"{fail_count} failed"
+        out_of_range = find_out_of_range_values(batch_data, target_columns)
+        for row_idx, col_name, value, precision in out_of_range[:10]:
+            logger.error(
+                (
+                    f"     🚨 Row {row_idx + 1} {col_name.replace('-', '_')}: "
+                    f"{value} (EXCEEDS {precision} LIMIT)"
+                )
             )
-        )
+        if len(out_of_range) > 10:
+            logger.error(f"   ... and {len(out_of_range) - 10} more values not shown")
+        elif not out_of_range:
+            logger.error("   No numeric value exceeds its column precision")
+
+        # Try to recover by retrying ever smaller parts of the batch
+        logger.error("🔄 Bisecting batch to salvage good data...")
+        recovery_results = {"rows_imported": 0, "errors": []}
+        recover_rows(conn, target_columns, batch_data, recovery_results)
+
+        imported = recovery_results["rows_imported"]
+        fail_count = len(batch_data) - imported
+        logger.error(f"🔄 Recovery results: {imported} succeeded, {fail_count} failed")
 
         if fail_count > 0:
             errors.append(
-                (
-                    "Batch failed, individual recovery: "
-                    f"{success_count}/{len(batch_data)} rows saved"
-                )
+                f"Batch failed, recovery: {imported}/{len(batch_data)} rows saved"
             )
 
         # Update the main error message
@@ -411,131 +540,158 @@ def insert_batch_data(conn, target_columns, batch_data):
     return imported, duplicates, errors
 
 
-def batch_query_existing_products(conn, product_names):
-    """Query multiple existing products in a single database call."""
-    if not product_names:
-        return {}
-
-    try:
-        # Get SQLAlchemy table object
-        table = get_nutritional_info_table()
-        engine = get_sqlalchemy_engine()
-
-        with engine.connect() as sqlalchemy_conn:
-            # Use SQLAlchemy for safe IN clause query
-            # Use func for database functions and proper column reference
-            from sqlalchemy import func
-
-            stmt = select(table).where(
-                func.lower(func.trim(table.c.product_name)).in_(
-                    [name.strip().lower() for name in product_names]
-                )
-            )
-
-            result = sqlalchemy_conn.execute(stmt)
-
-            # Build result dictionary
-            existing_products = {}
-            for row in result:
-                row_dict = dict(row._mapping)
-                product_name_clean = row_dict["product_name"].strip().lower()
-                existing_products[product_name_clean] = row_dict
-
-            return existing_products
-
-    except Exception as e:
-        logger.error(f"Failed to batch query existing products: {e}")
-        return {}
-
-
-def update_existing_product_batch(conn, original_row, merged_row, target_columns):
-    """Update a single existing product with merged data."""
-    try:
-        # Find fields that have changed
-        update_fields = []
-        update_values = []
-
-        for col in target_columns:
-            if col == "code":  # Skip primary identifier
-                continue
-
-            db_col = col.replace("-", "_")
-            original_value = original_row.get(db_col)
-            merged_value = merged_row.get(db_col)
-
-            # Apply numeric cleaning/rounding for numeric fields to match DB precision
-            if (
-                col.endswith("_100g")
-                or col == "nutriscore_score"
-                or col == "serving_quantity"
-            ):
-                merged_value = clean_numeric_value(merged_value, col)
-
-            # Only update if value has actually changed
-            if original_value != merged_value:
-                if db_col == "allergens":
-                    # Special handling for allergens - ensure it's properly formatted
-                    if isinstance(merged_value, list):
-                        update_fields.append(
-                            f"{db_col} = %s::recipe_manager.allergen_enum[]"
-                        )
-                    else:
-                        # Skip invalid allergen data
-                        logger.warning(
-                            (
-                                "⚠️  Skipping invalid allergen data for product "
-                                f"{original_row.get('nutritional_info_id')}: "
-                                f"{merged_value}"
-                            )
-                        )
-                        continue
-                else:
-                    update_fields.append(f"{db_col} = %s")
-                update_values.append(merged_value)
-
-        # Execute update if we have changes
-        if update_fields:
-            # Get SQLAlchemy table object
-            table = get_nutritional_info_table()
-            engine = get_sqlalchemy_engine()
-
-            # Build update dictionary from changed fields
-            update_dict = {}
-            value_index = 0
-            for field_expr in update_fields:
-                if " = " in field_expr:
-                    field_name = field_expr.split(" = ")[0]
-                    if "::" in field_expr:
-                        # Handle special cast syntax (like allergens)
-                        field_name = field_name.strip()
-                    update_dict[field_name] = update_values[value_index]
-                    value_index += 1
-
-            # Add updated_at timestamp
-            update_dict["updated_at"] = text("now()")
-
-            with engine.connect() as sqlalchemy_conn:
-                stmt = (
-                    update(table)
-                    .where(
-                        table.c.nutritional_info_id
-                        == original_row["nutritional_info_id"]
-                    )
-                    .values(update_dict)
-                )
-
-                sqlalchemy_conn.execute(stmt)
-                sqlalchemy_conn.commit()
+def get_column_types(conn):
+    """Get the SQL type of every nutritional_info column, read once per process."""
+    global _column_types
+    if _column_types is None:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT attname, format_type(atttypid, atttypmod)
+                FROM pg_attribute
+                WHERE attrelid = 'recipe_manager.nutritional_info'::regclass
+                  AND attnum > 0 AND NOT attisdropped
+                """)
+            _column_types = dict(cursor.fetchall())
+    return _column_types
+
+
+def build_merge_condition(col, db_col, column_type):
+    """Build the SQL condition for a duplicate's value to replace the stored one."""
+    new, existing = f"s.{db_col}", f"t.{db_col}"
+
+    # Always update if existing is null/empty
+    conditions = [f"{existing} IS NULL"]
+    if column_type == "text" or column_type.startswith("character varying"):
+        conditions.append(f"{existing} = ''")
+
+    # For numeric nutrition fields, prefer non-zero values
+    if col in MERGE_NUMERIC_COLUMNS:
+        conditions.append(f"({existing} = 0 AND {new} > 0)")
+    # For text fields, prefer longer/more detailed content
+    elif col in PREFER_LONGER_COLUMNS:
+        length = "cardinality" if column_type.endswith("[]") else "length"
+        conditions.append(f"{length}({new}) > {length}({existing})")
+
+    # Don't update if new value is null
+    return f"{new} IS NOT NULL AND ({' OR '.join(conditions)})"
+
+
+def build_merge_statements(conn, target_columns):
+    """
+    Build the statements that merge duplicate rows of target_columns.
+
+    Rows are copied into a session-local staging table keyed by cleaned
+    product name, then joined to the existing products in one UPDATE ... FROM.
+    The rules of build_merge_condition are applied column by column in SQL.
+
+    Args:
+        conn: Database connection
+        target_columns: Columns of each row, in order
+
+    Returns:
+        tuple: (create_sql, copy_sql, merge_sql, array_indexes) where
+        array_indexes are the positions of array-typed columns in a staged row
+    """
+    key = tuple(target_columns)
+    if key in _merge_statements:
+        return _merge_statements[key]
+
+    column_types = get_column_types(conn)
+    merge_columns = [
+        (col, db_col) for col, db_col in zip(key, get_db_columns(key)) if col != "code"
+    ]
 
-    except Exception as e:
-        # CHANGED: Report errors to console immediately
-        error_msg = (
-            f"❌ MERGE UPDATE FAILED: Product ID "
-            f"{original_row.get('nutritional_info_id', 'unknown')}: {e}"
+    # Integers are staged as numeric so cleaned floats like "5.0" still load
+    staging_columns = ", ".join(
+        f"{db_col} "
+        f"{'numeric' if column_types[db_col] == 'integer' else column_types[db_col]}"
+        for _, db_col in merge_columns
+    )
+    create_sql = (
+        f"CREATE TEMP TABLE IF NOT EXISTS {DUPLICATES_STAGING_TABLE} "
+        f"(product_name_clean text, {staging_columns})"
+    )
+    source_columns = ", ".join(db_col for _, db_col in merge_columns)
+    copy_sql = (
+        f"COPY {DUPLICATES_STAGING_TABLE} (product_name_clean, {source_columns}) "
+        "FROM STDIN WITH (FORMAT csv)"
+    )
+
+    conditions = [
+        build_merge_condition(col, db_col, column_types[db_col])
+        for col, db_col in merge_columns
+    ]
+    set_clause = ", ".join(
+        f"{db_col} = CASE WHEN {condition} THEN s.{db_col} ELSE t.{db_col} END"
+        for (col, db_col), condition in zip(merge_columns, conditions)
+    )
+    any_change = " OR ".join(f"({condition})" for condition in conditions)
+
+    merge_sql = f"""
+        WITH target AS (
+            SELECT DISTINCT ON (lower(trim(n.product_name)))
+                n.nutritional_info_id, s.product_name_clean
+            FROM recipe_manager.nutritional_info AS n
+            JOIN {DUPLICATES_STAGING_TABLE} AS s
+              ON lower(trim(n.product_name)) = s.product_name_clean
+            ORDER BY lower(trim(n.product_name)), n.nutritional_info_id
+        ),
+        updated AS (
+            UPDATE recipe_manager.nutritional_info AS t
+            SET {set_clause}, updated_at = now()
+            FROM target JOIN {DUPLICATES_STAGING_TABLE} AS s USING (product_name_clean)
+            WHERE t.nutritional_info_id = target.nutritional_info_id
+              AND ({any_change})
+            RETURNING 1
         )
-        logger.error(error_msg)  # Changed from debug to error
-
-        # Also add a counter to track these errors
-        return False  # Indicate failure
-
-    return True  # Indicate success
+        SELECT (SELECT count(*) FROM target), (SELECT count(*) FROM updated)
+    """
+
+    # Staged rows lead with the product name, shifting every index by one
+    array_indexes = [
+        index
+        for index, (_, db_col) in enumerate(merge_columns, start=1)
+        if column_types[db_col].endswith("[]")
+    ]
+    _merge_statements[key] = create_sql, copy_sql, merge_sql, array_indexes
+    return _merge_statements[key]
+
+
+def merge_duplicate_products(conn, target_columns, product_names, rows):
+    """
+    Merge cleaned duplicate rows into existing products in a single statement.
+
+    Each row is matched to the existing product with the same trimmed,
+    lowercased name, and the rules of build_merge_condition are applied
+    column by column in SQL.
+
+    Args:
+        conn: Database connection
+        target_columns: Columns of each row, in order
+        product_names: Cleaned product name of each row
+        rows: Cleaned rows, as prepared for insertion
+
+    Returns:
+        tuple: (products matched, products updated)
+    """
+    if not rows:
+        return 0, 0
+
+    create_sql, copy_sql, merge_sql, array_indexes = build_merge_statements(
+        conn, target_columns
+    )
+    code_index = target_columns.index("code")
+    staged_rows = (
+        (name, *(value for i, value in enumerate(row) if i != code_index))
+        for name, row in zip(product_names, rows)
+    )
+
+    with conn.cursor() as cursor:
+        cursor.execute(create_sql)
+        cursor.copy_expert(copy_sql, rows_to_csv(staged_rows, array_indexes))
+        cursor.execute(merge_sql)
+        matched, updated = cursor.fetchone()
+        cursor.execute(f"TRUNCATE {DUPLICATES_STAGING_TABLE}")
+    conn.commit()
+
+    return matched, updated
@@ -7,111 +7,51 @@
 
 import logging
 
-import pandas as pd
+from data_cleaning import is_missing
+from pattern_matching import build_automaton, find_matches
 
 logger = logging.getLogger(__name__)
 
-
-def map_food_groups_to_enum(food_groups_value):
-    """
-    Map OpenFoodFacts food groups to our standardized food_group_enum.
-
-    Args:
-        food_groups_value: String containing food groups from OpenFoodFacts
-
-    Returns:
-        str: Mapped enum value or 'UNKNOWN' if no mapping found
-    """
-    if not food_groups_value or pd.isna(food_groups_value):
-        return "UNKNOWN"
-
-    # Convert to lowercase for easier matching
-    food_groups_lower = str(food_groups_value).lower()
-
-    # Define mapping rules based on OpenFoodFacts taxonomy
-    # Order matters - more specific matches should come first
-
-    # Vegetables
-    if any(
-        keyword in food_groups_lower
-        for keyword in ["en:vegetables", "en:potatoes", "en:fruits-and-vegetables"]
-    ):
-        return "VEGETABLES"
-
-    # Fruits
-    if any(
-        keyword in food_groups_lower
-        for keyword in [
-            "en:fruits",
-            "en:dried-fruits",
-            "en:fruit-juices",
-            "en:fruit-nectars",
-        ]
-    ):
-        return "FRUITS"
-
-    # Meat
-    if any(
-        keyword in food_groups_lower
-        for keyword in ["en:meat-other-than-poultry", "en:processed-meat", "en:offals"]
-    ):
-        return "MEAT"
-
-    # Poultry
-    if "en:poultry" in food_groups_lower:
-        return "POULTRY"
-
-    # Seafood
-    if any(
-        keyword in food_groups_lower
-        for keyword in [
-            "en:fish-and-seafood",
-            "en:fatty-fish",
-            "en:lean-fish",
-            "en:fish-meat-eggs",
-        ]
-    ):
-        return "SEAFOOD"
-
-    # Dairy
-    if any(
-        keyword in food_groups_lower
-        for keyword in [
+# Mapping rules based on OpenFoodFacts taxonomy
+# Order matters - more specific matches should come first
+_FOOD_GROUP_KEYWORDS = [
+    ("VEGETABLES", ["en:vegetables", "en:potatoes", "en:fruits-and-vegetables"]),
+    (
+        "FRUITS",
+        ["en:fruits", "en:dried-fruits", "en:fruit-juices", "en:fruit-nectars"],
+    ),
+    ("MEAT", ["en:meat-other-than-poultry", "en:processed-meat", "en:offals"]),
+    ("POULTRY", ["en:poultry"]),
+    (
+        "SEAFOOD",
+        ["en:fish-and-seafood", "en:fatty-fish", "en:lean-fish", "en:fish-meat-eggs"],
+    ),
+    (
+        "DAIRY",
+        [
             "en:cheese",
             "en:milk-and-yogurt",
             "en:dairy-desserts",
             "en:ice-cream",
             "en:eggs",
-        ]
-    ):
-        return "DAIRY"
-
-    # Grains
-    if any(
-        keyword in food_groups_lower
-        for keyword in [
+        ],
+    ),
+    (
+        "GRAINS",
+        [
             "en:cereals",
             "en:bread",
             "en:breakfast-cereals",
             "en:cereals-and-potatoes",
             "en:biscuits-and-cakes",
             "en:pastries",
-        ]
-    ):
-        return "GRAINS"
-
-    # Legumes
-    if "en:legumes" in food_groups_lower:
-        return "LEGUMES"
-
-    # Nuts and Seeds
-    if "en:nuts" in food_groups_lower:
-        return "NUTS_SEEDS"
-
-    # Beverages
-    if any(
-        keyword in food_groups_lower
-        for keyword in [
+        ],
+    ),
+    ("LEGUMES", ["en:legumes"]),
+    ("NUTS_SEEDS", ["en:nuts"]),
+    (
+        "BEVERAGES",
+        [
             "en:unsweetened-beverages",
             "en:sweetened-beverages",
             "en:artificially-sweetened-beverages",
@@ -119,14 +59,12 @@ def map_food_groups_to_enum(food_groups_value):
             "en:alcoholic-beverages",
             "en:teas-and-herbal-teas-and-coffees",
             "en:waters-and-flavored-waters",
-        ]
-    ):
-        return "BEVERAGES"
-
-    # Processed Foods (catch-all for manufactured/processed items)
-    if any(
-        keyword in food_groups_lower
-        for keyword in [
+        ],
+    ),
+    # Catch-all for manufactured/processed items
+    (
+        "PROCESSED_FOODS",
+        [
             "en:sweets",
             "en:dressings-and-sauces",
             "en:one-dish-meals",
@@ -137,9 +75,40 @@ def map_food_groups_to_enum(food_groups_value):
             "en:chocolate-products",
             "en:salty-and-fatty-products",
             "en:soups",
-        ]
-    ):
-        return "PROCESSED_FOODS"
+        ],
+    ),
+]
+
+# Compiled once at import, labelled by rule position so the lowest one found
+# is the rule that would have matched first
+_FOOD_GROUP_AUTOMATON = build_automaton(
+    (keyword, priority)
+    for priority, (_, keywords) in enumerate(_FOOD_GROUP_KEYWORDS)
+    for keyword in keywords
+)
+
+
+def map_food_groups_to_enum(food_groups_value):
+    """
+    Map OpenFoodFacts food groups to our standardized food_group_enum.
+
+    Every keyword is searched for in a single scan of the value.
+
+    Args:
+        food_groups_value: String containing food groups from OpenFoodFacts
+
+    Returns:
+        str: Mapped enum value or 'UNKNOWN' if no mapping found
+    """
+    if is_missing(food_groups_value):
+        return "UNKNOWN"
+
+    # Convert to lowercase for easier matching
+    food_groups_lower = str(food_groups_value).lower()
+
+    matches = find_matches(_FOOD_GROUP_AUTOMATON, food_groups_lower)
+    if matches:
+        return _FOOD_GROUP_KEYWORDS[min(matches)][0]
 
     # Default fallback
     logger.debug(f"No mapping found for food group: {food_groups_value}")
@@ -5,30 +5,399 @@
 
 """Core import logic for OpenFoodFacts data."""
 
+import gzip
+import io
 import logging
+import multiprocessing
+import os
+import queue
+import shutil
+import subprocess
+import threading
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import chain, repeat
 from pathlib import Path
-from typing import Any
+from typing import Any, Generator, Iterable, Iterator, Optional, TypeVar
 
+import numpy as np
 import pandas as pd
-from data_processing import is_american_product, prepare_row_data
-from database import get_database_connection, get_table_columns, insert_batch_data
-from duplicate_handling import merge_queue_items, process_duplicate_queue_batch
+from data_processing import COUNTRY_COLUMNS, is_american_mask, prepare_chunk_data
+from database import (
+    configure_import_session,
+    get_database_connection,
+    get_table_columns,
+    get_thread_connection,
+    insert_batch_data,
+)
+from duplicate_handling import process_duplicate_queue_batch
 
 logger = logging.getLogger(__name__)
 
+# Rows per cleaning task handed to worker processes; inserts join these
+# into larger batches
+BATCH_SIZE = 1000
 
-def import_ingredients_from_csv(csv_path: Path) -> dict[str, Any]:
+# Most recent error messages kept in the results, older ones are only counted
+MAX_ERRORS = 100
+
+# Chunks read ahead of the one being processed
+READ_AHEAD_CHUNKS = 2
+
+# Gzip input inflated on a background thread when pigz is not installed
+DECOMPRESS_BLOCK_SIZE = 4 << 20
+DECOMPRESS_AHEAD_BLOCKS = 4
+
+# Bytes read from the start of the file to estimate its line count
+LINE_ESTIMATE_SAMPLE_BYTES = 4 << 20
+
+# A product must report at least one of these to be imported
+NUTRITION_COLUMNS = [
+    "energy-kcal_100g",
+    "proteins_100g",
+    "carbohydrates_100g",
+    "fat_100g",
+]
+
+T = TypeVar("T")
+
+
+def read_ahead(
+    items: Iterable[T], depth: int = READ_AHEAD_CHUNKS
+) -> Generator[T, None, None]:
+    """
+    Read items on a background thread while the caller processes earlier ones.
+
+    Decompressing and parsing the CSV overlaps with cleaning and database round
+    trips, which wait without holding the GIL. An error from the reader is
+    raised to the caller in place of the item it failed on.
+
+    Args:
+        items: Items to read, CSV chunks or decompressed blocks
+        depth: Most items held ahead of the caller
+
+    Returns:
+        Iterator over the same items, in order
+    """
+    buffer: queue.Queue = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    done = object()
+
+    def put(item: Any) -> bool:
+        # Give up once the caller stops reading, rather than block forever
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce() -> None:
+        try:
+            for item in items:
+                if not put(item):
+                    return
+        except Exception as e:
+            put(e)
+        else:
+            put(done)
+
+    reader = threading.Thread(target=produce, name="csv-reader", daemon=True)
+    reader.start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        reader.join()
+
+
+class BlockStream(io.RawIOBase):
+    """Readable binary stream over an iterator of byte blocks."""
+
+    def __init__(self, blocks: Iterator[bytes]):
+        super().__init__()
+        self._blocks = blocks
+        self._pending = memoryview(b"")
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer: Any) -> int:
+        while not self._pending:
+            block = next(self._blocks, b"")
+            if not block:
+                return 0
+            self._pending = memoryview(block)
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+    def close(self) -> None:
+        # Stops the thread producing the blocks, if any
+        close_blocks = getattr(self._blocks, "close", None)
+        if close_blocks is not None:
+            close_blocks()
+        super().close()
+
+
+def read_gzip_blocks(csv_path: Path) -> Iterator[bytes]:
+    """Inflate a gzip file block by block."""
+    with gzip.open(csv_path, "rb") as stream:
+        while block := stream.read(DECOMPRESS_BLOCK_SIZE):
+            yield block
+
+
+def estimate_line_count(
+    csv_path: Path, sample_bytes: int = LINE_ESTIMATE_SAMPLE_BYTES
+) -> int:
+    """
+    Estimate the lines in a CSV file from the line density of its first bytes.
+
+    Only the start of the file is read. For gzip input the sample is inflated
+    and scaled by the compressed bytes it took, so the estimate also follows
+    the file's compression ratio.
+
+    Args:
+        csv_path: CSV file, optionally gzip compressed
+        sample_bytes: Uncompressed bytes to sample
+
+    Returns:
+        int: Estimated line count, header included
+    """
+    file_size = csv_path.stat().st_size
+    with open(csv_path, "rb") as raw:
+        if csv_path.suffix.lower() == ".gz":
+            with gzip.open(raw, "rb") as stream:
+                try:
+                    sample = stream.read(sample_bytes)
+                except EOFError:
+                    # Truncated within the sample, the CSV reader reports it
+                    sample = b""
+        else:
+            sample = raw.read(sample_bytes)
+        sampled_file_bytes = raw.tell()
+
+    lines = sample.count(b"\n")
+    if len(sample) < sample_bytes:
+        # The whole file fit in the sample, count an unterminated last line
+        if sample and not sample.endswith(b"\n"):
+            lines += 1
+        return lines
+    return round(lines * file_size / sampled_file_bytes)
+
+
+def hash_product_names(names: pd.Series) -> np.ndarray:
+    """
+    Hash cleaned product names to 64-bit integers.
+
+    Seen names are remembered by hash, an int takes a fraction of the memory
+    of the name it stands for. At a few million names the chance of any two
+    colliding is well under one in a million.
+
+    Args:
+        names: Cleaned product names, none missing
+
+    Returns:
+        np.ndarray: uint64 hash per name
+    """
+    return pd.util.hash_array(names.to_numpy(dtype=object))
+
+
+def filter_chunk(
+    df_chunk: pd.DataFrame, seen_name_hashes: set[int], results: dict[str, Any]
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Split a chunk into rows to import and rows repeating a seen product name.
+
+    Every filter is computed for the whole chunk with vectorized column
+    operations. Rows are still judged in file order: a name counts as seen
+    from the first row carrying it that passes every filter, and later rows
+    with that name are duplicates whatever their own data.
+
+    Args:
+        df_chunk: Raw CSV rows
+        seen_name_hashes: Hashes of the cleaned names of imported rows,
+            updated in place
+        results: Import results, skip counters updated in place
+
+    Returns:
+        tuple: (rows to import, duplicate rows indexed by cleaned product name)
+    """
+    fields = df_chunk.reindex(columns=["code", "product_name", *NUTRITION_COLUMNS])
+
+    # Skip rows without a product code or product name
+    codes = fields["code"].astype("string").str.strip()
+    names = fields["product_name"].astype("string").str.strip()
+    has_identity = ((codes.fillna("") != "") & (names.fillna("") != "")).to_numpy()
+    results["rows_skipped"] += int((~has_identity).sum())
+
+    candidates = df_chunk[has_identity]
+    names = names[has_identity].str.lower()
+    hashes = hash_product_names(names)
+    has_nutrition = (
+        fields[has_identity][NUTRITION_COLUMNS].notna().any(axis=1).to_numpy()
+    )
+    is_american = is_american_mask(candidates).to_numpy()
+
+    # Names first taken in this chunk, by the earliest row passing every filter
+    seen_before = np.fromiter(
+        (name_hash in seen_name_hashes for name_hash in hashes.tolist()),
+        dtype=bool,
+        count=len(hashes),
+    )
+    taken = np.flatnonzero(has_nutrition & is_american & ~seen_before)
+    taken_hashes, first = np.unique(hashes[taken], return_index=True)
+    taken_positions = taken[first]
+
+    # Rows repeating a name seen earlier, in this chunk or a previous one
+    first_taken = pd.Series(hashes).map(pd.Series(taken_positions, index=taken_hashes))
+    is_duplicate = seen_before | (np.arange(len(hashes)) > first_taken.to_numpy())
+    kept = np.zeros(len(hashes), dtype=bool)
+    kept[taken_positions] = True
+
+    results["rows_skipped_duplicate_name"] += int(is_duplicate.sum())
+    results["rows_skipped_no_nutrition"] += int((~is_duplicate & ~has_nutrition).sum())
+    results["rows_skipped_non_american"] += int(
+        (~is_duplicate & has_nutrition & ~is_american).sum()
+    )
+    seen_name_hashes.update(taken_hashes.tolist())
+
+    df_duplicates = candidates[is_duplicate].set_axis(names[is_duplicate].tolist())
+    return candidates[kept], df_duplicates
+
+
+def worker_context() -> multiprocessing.context.BaseContext:
+    """
+    Get the start method for cleaning worker processes.
+
+    Workers start lazily, after the reader threads and database connection
+    exist, and a forked child could inherit a lock one of them held. They are
+    started from a clean forkserver process instead, or spawned where that is
+    unavailable.
+
+    Returns:
+        Multiprocessing context for the worker pool
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
+
+
+def prepare_batches(
+    executor: Optional[Executor],
+    df_rows: pd.DataFrame,
+    csv_columns: set[str],
+    target_columns: list[str],
+) -> Iterable[list[tuple]]:
+    """
+    Clean rows in insert-sized batches, in parallel when an executor is given.
+
+    Args:
+        executor: Pool to clean batches in, or None to clean them inline
+        df_rows: Rows that passed the import filters
+        csv_columns: Columns present in the CSV
+        target_columns: Database columns to prepare
+
+    Returns:
+        Iterable of cleaned batches, in row order
+    """
+    batches = [
+        df_rows.iloc[start : start + BATCH_SIZE]
+        for start in range(0, len(df_rows), BATCH_SIZE)
+    ]
+    if executor is None:
+        return (
+            prepare_chunk_data(batch, csv_columns, target_columns) for batch in batches
+        )
+    return executor.map(
+        prepare_chunk_data, batches, repeat(csv_columns), repeat(target_columns)
+    )
+
+
+def coalesce_batches(
+    batches: Iterable[list[tuple]], size: int
+) -> Iterator[list[tuple]]:
+    """
+    Join consecutive cleaned batches into batches of at least size rows.
+
+    Args:
+        batches: Cleaned batches, in row order
+        size: Rows to gather before yielding, the last batch may be smaller
+
+    Returns:
+        Iterator over the joined batches, in row order
+    """
+    pending: list[tuple] = []
+    for batch in batches:
+        pending.extend(batch)
+        if len(pending) >= size:
+            yield pending
+            pending = []
+    if pending:
+        yield pending
+
+
+def insert_batch_on_thread_connection(
+    connections: list[Any], target_columns: list[str], batch_data: list[tuple]
+) -> tuple[int, int, list[str]]:
+    """
+    Insert and commit a batch on a connection owned by the calling thread.
+
+    Args:
+        connections: Every connection opened so far, for closing at the end
+        target_columns: Database columns of each row
+        batch_data: Cleaned rows
+
+    Returns:
+        tuple: (imported, duplicates, errors) as from insert_batch_data
+    """
+    conn = get_thread_connection(connections)
+    try:
+        result = insert_batch_data(conn, target_columns, batch_data)
+        conn.commit()
+        return result
+    except Exception:
+        # Leave the thread's connection usable for its next batch
+        conn.rollback()
+        raise
+
+
+def import_ingredients_from_csv(
+    csv_path: Path, workers: Optional[int] = None, insert_connections: int = 1
+) -> dict[str, Any]:
     """
     Import ingredients from OpenFoodFacts CSV into the database.
 
     Args:
         csv_path: Path to the OpenFoodFacts CSV file
+        workers: Processes used to clean rows, defaults to the CPU count;
+            1 cleans inline
+        insert_connections: Connections batches are inserted and queued
+            duplicates merged over in parallel;
+            with more than one, each batch is committed on its own and rows
+            repeating a code across concurrent batches may land in either order
 
     Returns:
         dict: Summary of import results
     """
     logger.info(f"🚀 Starting import from {csv_path}")
 
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers < 1 or insert_connections < 1:
+        raise ValueError(
+            "workers and insert_connections must be at least 1, "
+            f"got {workers} and {insert_connections}"
+        )
+
     # Initialize results
     results: dict[str, Any] = {
         "file_path": str(csv_path),
@@ -41,20 +410,40 @@ def import_ingredients_from_csv(csv_path: Path) -> dict[str, Any]:
         "rows_skipped_non_american": 0,
         "rows_merged_duplicates": 0,
         "duplicate_codes": 0,
-        "errors": [],
+        "errors": deque(maxlen=MAX_ERRORS),
+        "error_count": 0,
     }
 
     # Track seen product names to avoid duplicates
-    seen_product_names: set[str] = set()
+    seen_name_hashes: set[int] = set()
 
-    # Batch duplicate processing for performance - use dict for easy merging
-    duplicate_queue: dict[str, dict[str, Any]] = {}  # product_name_clean -> queue_item
+    # Raw duplicate rows per chunk, indexed by cleaned name, merged in batches
+    duplicate_rows: list[pd.DataFrame] = []
 
     conn = None
+    executor = None
+    insert_pool = None
+    insert_pool_connections: list[Any] = []
+    decompressor: Optional[subprocess.Popen] = None
+    csv_stream: Optional[io.BufferedReader] = None
+    chunks: Optional[Generator[pd.DataFrame, None, None]] = None
 
     try:
+        # Filtering stays in this process, cleaning fans out to worker processes
+        if workers > 1:
+            logger.info(f"⚙️ Cleaning rows with {workers} worker processes")
+            executor = ProcessPoolExecutor(
+                max_workers=workers, mp_context=worker_context()
+            )
+
+        # Batches go over several connections at once, each on its own thread
+        if insert_connections > 1:
+            logger.info(f"⚙️ Inserting batches over {insert_connections} connections")
+            insert_pool = ThreadPoolExecutor(max_workers=insert_connections)
+
         # Get database connection
         conn = get_database_connection()
+        configure_import_session(conn)
 
         # Get target columns for database
         target_columns = get_table_columns()
@@ -62,34 +451,59 @@ def import_ingredients_from_csv(csv_path: Path) -> dict[str, Any]:
         # Read CSV file
         logger.info("📋 Reading CSV file...")
 
+        # Only load the columns the import uses, the full export has ~200
+        source_columns = {*target_columns, "serving_size", *COUNTRY_COLUMNS}
+
         # Read CSV in chunks to handle large files with error handling for bad rows
         chunk_size = 10000
         csv_params = {
             "sep": "\t",
             "chunksize": chunk_size,
+            "usecols": lambda column: column in source_columns,
             "low_memory": False,
             "on_bad_lines": "warn",  # Warn about bad lines but continue
             "encoding_errors": "replace",  # Replace encoding errors
             "dtype": str,  # Read all columns as strings first to avoid type errors
         }
 
+        # Gzip input is decompressed by pigz in its own process when installed,
+        # otherwise by zlib on a thread of its own
+        csv_source: Any = csv_path
         if csv_path.suffix.lower() == ".gz":
-            csv_params["compression"] = "gzip"
+            pigz_path = shutil.which("pigz")
+            if pigz_path:
+                decompressor = subprocess.Popen(
+                    [pigz_path, "-dc", str(csv_path)],
+                    stdout=subprocess.PIPE,
+                    bufsize=1 << 20,
+                )
+                csv_source = decompressor.stdout
+                logger.info("  - Decompression: pigz")
+            else:
+                # Inflate a few blocks ahead of the parser, zlib releases the GIL
+                csv_stream = io.BufferedReader(
+                    BlockStream(
+                        read_ahead(read_gzip_blocks(csv_path), DECOMPRESS_AHEAD_BLOCKS)
+                    )
+                )
+                csv_source = csv_stream
+                logger.info("  - Decompression: gzip on a background thread")
 
         logger.info("CSV parsing parameters:")
         logger.info(f"  - Chunk size: {chunk_size}")
+        logger.info(f"  - Columns loaded: {len(source_columns)} at most")
         logger.info("  - Bad lines handling: warn and skip")
         logger.info("  - Encoding errors: replace")
 
         try:
-            df_reader = pd.read_csv(csv_path, **csv_params)
+            df_reader = pd.read_csv(csv_source, **csv_params)
         except Exception as csv_error:
             logger.error(f"Failed to open CSV file: {csv_error}")
             raise
 
         # Analyze CSV structure before processing (read first chunk to get column info)
         logger.info("📋 Analyzing CSV structure...")
-        first_chunk = next(iter(df_reader))
+        first_chunk = next(df_reader)
         csv_columns = set(first_chunk.columns)
 
         logger.info(f"CSV has {len(csv_columns)} columns")
@@ -106,18 +520,10 @@ def import_ingredients_from_csv(csv_path: Path) -> dict[str, Any]:
             f"Available target columns: {len(available_targets)}/{len(target_columns)}"
         )
 
-        # Re-create the reader since we consumed the first chunk
-        df_reader = pd.read_csv(csv_path, **csv_params)
-
-        # Get accurate chunk estimate by counting total lines
+        # Estimate the chunk count from the start of the file, for progress logs
         logger.info("📊 Estimating total number of chunks...")
-        chunk_size = 10000
-        total_lines = (
-            -1
-        )  # TODO: IMPLEMENT AN EFFICIENT & ACCURATE WAY TO CALCULATE THIS
-        estimated_chunks = (
-            390  # TODO: IMPLEMENT AN EFFICIENT & ACCURATE WAY TO CALCULATE THIS
-        )
+        total_lines = estimate_line_count(csv_path)
+        estimated_chunks = max(1, -(-(total_lines - 1) // chunk_size))
         logger.info(
             (
                 f"📊 File has ~{total_lines:,} lines, estimated {estimated_chunks} "
@@ -128,7 +534,13 @@ def import_ingredients_from_csv(csv_path: Path) -> dict[str, Any]:
         # Process chunks with accurate progress tracking
         total_processed = 0
 
-        for chunk_num, df_chunk in enumerate(df_reader, 1):
+        # One COPY per chunk, or one per connection when inserting in parallel
+        insert_batch_size = max(BATCH_SIZE, chunk_size // insert_connections)
+
+        # The first chunk was read for its columns, process it before the rest;
+        # later chunks are parsed in the background while this one is processed
+        chunks = read_ahead(chain([first_chunk], df_reader))
+        for chunk_num, df_chunk in enumerate(chunks, 1):
             # Progress message with accurate estimate
             logger.info(
                 (
@@ -137,116 +549,77 @@ def import_ingredients_from_csv(csv_path: Path) -> dict[str, Any]:
                 )
             )
 
-            # Prepare batch data
-            batch_data: list[list[Any]] = []
-            rows_in_chunk = 0
-
-            for _, row in df_chunk.iterrows():
-                # Skip rows without a product code
-                if pd.isna(row.get("code")) or not str(row.get("code")).strip():
-                    results["rows_skipped"] += 1
-                    continue
-
-                # Skip rows without product name
-                product_name = row.get("product_name")
-                if pd.isna(product_name) or not str(product_name).strip():
-                    results["rows_skipped"] += 1
-                    continue
-
-                # Handle duplicate product names by queuing for batch processing
-                product_name_clean = str(product_name).strip().lower()
-                if product_name_clean in seen_product_names:
-                    # Check if already in queue
-                    if product_name_clean in duplicate_queue:
-                        # Merge with existing queue item
-                        existing_item = duplicate_queue[product_name_clean]
-                        merged_row = merge_queue_items(
-                            existing_item["row"], row, csv_columns, target_columns
-                        )
-                        existing_item["row"] = merged_row
-                    else:
-                        # Add new item to queue
-                        duplicate_queue[product_name_clean] = {
-                            "product_name_clean": product_name_clean,
-                            "row": row,
-                            "csv_columns": csv_columns,
-                            "target_columns": target_columns,
-                        }
-                    results["rows_skipped_duplicate_name"] += 1
-                    continue
-
-                # Check if product has meaningful nutritional data
-                has_nutrition = any(
-                    [
-                        not pd.isna(row.get("energy-kcal_100g")),
-                        not pd.isna(row.get("proteins_100g")),
-                        not pd.isna(row.get("carbohydrates_100g")),
-                        not pd.isna(row.get("fat_100g")),
-                    ]
-                )
-
-                if not has_nutrition:
-                    results["rows_skipped_no_nutrition"] += 1
-                    continue
-
-                # Filter for American products only
-                if not is_american_product(row):
-                    results["rows_skipped_non_american"] += 1
-                    continue
-
-                # Add to seen product names
-                seen_product_names.add(product_name_clean)
-
-                # Prepare row data
-                row_data = prepare_row_data(row, csv_columns, target_columns)
-                batch_data.append(row_data)
-                rows_in_chunk += 1
-
-                # Process in smaller batches for memory efficiency
-                if len(batch_data) >= 1000:
-                    imported, duplicates, errors = insert_batch_data(
-                        conn, target_columns, batch_data
+            # Split the chunk into new products and repeated product names
+            df_kept, df_duplicates = filter_chunk(df_chunk, seen_name_hashes, results)
+            if not df_duplicates.empty:
+                duplicate_rows.append(df_duplicates)
+
+            # Clean surviving rows in batches while earlier batches are inserted
+            rows_in_chunk = len(df_kept)
+            inserted = []
+            for batch_data in coalesce_batches(
+                prepare_batches(executor, df_kept, csv_columns, target_columns),
+                insert_batch_size,
+            ):
+                if insert_pool is None:
+                    # Each batch is its own transaction, as on the pool threads
+                    outcome = insert_batch_data(conn, target_columns, batch_data)
+                    conn.commit()
+                else:
+                    outcome = insert_pool.submit(
+                        insert_batch_on_thread_connection,
+                        insert_pool_connections,
+                        target_columns,
+                        batch_data,
                     )
-                    results["rows_imported"] += int(imported)
-                    results["duplicate_codes"] += int(duplicates)
-                    results["errors"].extend(list(errors))
-
-                    results["rows_processed"] += len(batch_data)
-                    total_processed += len(batch_data)
-                    batch_data = []
-
-            # Process remaining batch data
-            if batch_data:
-                imported, duplicates, errors = insert_batch_data(
-                    conn, target_columns, batch_data
-                )
+                inserted.append((len(batch_data), outcome))
+
+            # Parallel batches all land before the chunk's duplicates are merged
+            for batch_size, outcome in inserted:
+                if insert_pool is not None:
+                    outcome = outcome.result()
+                imported, duplicates, errors = outcome
                 results["rows_imported"] += int(imported)
                 results["duplicate_codes"] += int(duplicates)
-                results["errors"].extend(list(errors))
+                results["errors"].extend(errors)
+                results["error_count"] += len(errors)
 
-                results["rows_processed"] += len(batch_data)
-                total_processed += len(batch_data)
+                results["rows_processed"] += batch_size
+                total_processed += batch_size
 
             logger.info(f"Chunk {chunk_num} processed: {rows_in_chunk} valid rows")
 
             # Process queued duplicates every 10 chunks for better performance
-            if chunk_num % 10 == 0 and duplicate_queue:
-                process_duplicate_queue_batch(conn, duplicate_queue, results)
-                duplicate_queue = {}  # Clear the queue after processing
-
-            # Commit every 10 chunks to avoid losing too much progress
-            if chunk_num % 10 == 0:
-                conn.commit()
-                logger.info(
-                    (
-                        f"✅ Progress committed after chunk {chunk_num} "
-                        f"({results['rows_imported']} rows imported so far)"
-                    )
+            if chunk_num % 10 == 0 and duplicate_rows:
+                process_duplicate_queue_batch(
+                    conn,
+                    duplicate_rows,
+                    csv_columns,
+                    target_columns,
+                    results,
+                    insert_pool,
+                    insert_pool_connections,
                 )
+                duplicate_rows = []  # Clear the queue after processing
+
+        # A failed decompressor looks like a short file to the reader
+        if decompressor is not None and decompressor.wait() != 0:
+            raise RuntimeError(
+                f"pigz failed to decompress {csv_path} "
+                f"(exit code {decompressor.returncode})"
+            )
 
         # Process any remaining queued duplicates
-        if duplicate_queue:
-            process_duplicate_queue_batch(conn, duplicate_queue, results)
+        if duplicate_rows:
+            process_duplicate_queue_batch(
+                conn,
+                duplicate_rows,
+                csv_columns,
+                target_columns,
+                results,
+                insert_pool,
+                insert_pool_connections,
+            )
 
         # Final commit
         if conn:
@@ -268,6 +641,7 @@ def import_ingredients_from_csv(csv_path: Path) -> dict[str, Any]:
             "Consider using CSV repair tools or filtering the problematic rows"
         )
         results["errors"].append(str(error_msg))
+        results["error_count"] += 1
 
     except Exception as e:
         if conn:
@@ -277,9 +651,27 @@ def import_ingredients_from_csv(csv_path: Path) -> dict[str, Any]:
         error_msg = f"Import failed: {e}"
         logger.error(error_msg)
         results["errors"].append(str(error_msg))
+        results["error_count"] += 1
         raise
 
     finally:
+        # Stop the reader thread before closing the stream it reads from
+        if chunks is not None:
+            chunks.close()
+        if csv_stream is not None:
+            csv_stream.close()
+        if decompressor is not None:
+            if decompressor.stdout is not None:
+                decompressor.stdout.close()
+            if decompressor.poll() is None:
+                decompressor.terminate()
+            decompressor.wait()
+        if executor is not None:
+            executor.shutdown()
+        if insert_pool is not None:
+            insert_pool.shutdown()
+            for pool_conn in insert_pool_connections:
+                pool_conn.close()
         if conn:
             conn.close()
             logger.info("Database connection closed")
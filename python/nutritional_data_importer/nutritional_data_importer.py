@@ -26,6 +26,14 @@ logging.basicConfig(level=logging.INFO, format="%(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 
 
+def positive_int(value: str) -> int:
+    """Parse a command line count that must be at least 1."""
+    count = int(value)
+    if count < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return count
+
+
 def print_results(results: dict):
     """Print a nice summary of the import results."""
     print(f"\n{'='*50}")
@@ -66,11 +74,15 @@ def print_results(results: dict):
 
     if results["errors"]:
         print("")
-        print(f"❌ Errors: {len(results['errors'])}")
-        for error in results["errors"][:5]:  # Show first 5 errors
+        print(f"❌ Errors: {results['error_count']}")
+        # Show the 5 most recent errors, the final one explains an aborted import
+        recent_errors = list(results["errors"])[-5:]
+        for error in recent_errors:
             print(f"  - {error}")
-        if len(results["errors"]) > 5:
-            print(f"  ... and {len(results['errors']) - 5} more errors")
+        if results["error_count"] > len(recent_errors):
+            print(
+                f"  ... and {results['error_count'] - len(recent_errors)} more errors"
+            )
     else:
         print("✅ No errors")
     print(f"{'='*50}\n")
@@ -92,6 +104,20 @@ Examples:
         "csv_path", help="Path to the OpenFoodFacts CSV file (can be .csv or .csv.gz)"
     )
 
+    parser.add_argument(
+        "--workers",
+        type=positive_int,
+        default=None,
+        help="Processes used to clean rows (default: CPU count, 1 to disable)",
+    )
+
+    parser.add_argument(
+        "--insert-connections",
+        type=positive_int,
+        default=1,
+        help="Database connections to insert batches over in parallel (default: 1)",
+    )
+
     args = parser.parse_args()
 
     try:
@@ -101,9 +127,13 @@ Examples:
         # Log configuration
         logger.info("🔧 Configuration:")
         logger.info(f"  CSV file: {csv_path}")
+        logger.info(f"  Workers: {args.workers or 'CPU count'}")
+        logger.info(f"  Insert connections: {args.insert_connections}")
 
         # Run the import
-        results = import_ingredients_from_csv(csv_path)
+        results = import_ingredients_from_csv(
+            csv_path, workers=args.workers, insert_connections=args.insert_connections
+        )
 
         # Print results
         print_results(results)
@@ -0,0 +1,72 @@
+# Recipe Database - PostgreSQL database for recipe management
+# Copyright (c) 2024 Your Name <your.email@example.com>
+#
+# Licensed under the MIT License. See LICENSE file for details.
+
+"""Multi-pattern substring matching for OpenFoodFacts data import."""
+
+from collections import deque
+
+
+def build_automaton(pattern_pairs):
+    """Compile (pattern, label) pairs into an Aho-Corasick automaton.
+
+    The failure links are resolved at build time, so the result is a plain DFA:
+    every state maps each character it can advance on to its next state, and any
+    other character sends the scan back to the root.
+
+    Args:
+        pattern_pairs: Iterable of (pattern, label) tuples
+
+    Returns:
+        tuple: (transitions, outputs) where transitions is a list of per-state
+        dicts and outputs is a list of per-state frozensets of labels
+    """
+    goto = [{}]
+    outputs = [set()]
+
+    # Build the trie of all patterns
+    for pattern, label in pattern_pairs:
+        state = 0
+        for char in pattern:
+            next_state = goto[state].get(char)
+            if next_state is None:
+                next_state = len(goto)
+                goto[state][char] = next_state
+                goto.append({})
+                outputs.append(set())
+            state = next_state
+        outputs[state].add(label)
+
+    # Breadth-first pass to fold failure links into full transition tables
+    transitions = [dict(goto[0])] + [None] * (len(goto) - 1)
+    fail = [0] * len(goto)
+    queue = deque(goto[0].values())
+
+    while queue:
+        state = queue.popleft()
+        fallback = transitions[fail[state]]
+        outputs[state] |= outputs[fail[state]]
+
+        state_transitions = dict(fallback)
+        for char, child in goto[state].items():
+            fail[child] = fallback.get(char, 0)
+            state_transitions[char] = child
+            queue.append(child)
+        transitions[state] = state_transitions
+
+    return transitions, [frozenset(labels) for labels in outputs]
+
+
+def find_matches(automaton, text):
+    """Return the set of labels whose patterns occur anywhere in text."""
+    transitions, outputs = automaton
+    found = set()
+    state = 0
+
+    for char in text:
+        state = transitions[state].get(char, 0)
+        if outputs[state]:
+            found |= outputs[state]
+
+    return found